@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+'''
+Reproducible crawl benchmark against the fake Graph API server, run from
+the repository root:
+
+    python benchmarks/crawl.py --places 2000 --latency 0.05 --error-rate 0.01
+
+The fake server runs in its own process and every phase (get_places_loc,
+update_places, get_events_from_places) in a fresh one, sharing a
+temporary SQLite database. For every phase it reports the Graph requests
+per second, the p50/p99 request latency (including the wait for the rate
+limiter) and the peak RSS of the phase's process.
+'''
+# STL imports
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+import fake_graph  # noqa: E402
+
+PHASES = ('places', 'update', 'events')
+CITY = 'Benchmark City'
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_phase(args):
+    # Runs in its own process, prints the results as JSON
+    import fbd.tools
+    from fbd import Gatherer, Storage
+
+    fbd.tools.pin_city(CITY, *fake_graph.CENTER)
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    storage = Storage(db_url=f'sqlite:///{args.db}')
+    gatherer = Gatherer('benchmark', 'secret', storage=storage, logger=logger,
+                        graph_url=args.graph_url, rate_limit=args.rate_limit,
+                        max_retries=args.max_retries)
+
+    latencies = []
+    fetch = gatherer._fetch
+
+    async def timed_fetch(*fetch_args, **fetch_kwargs):
+        start = time.perf_counter()
+        try:
+            return await fetch(*fetch_args, **fetch_kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    gatherer._fetch = timed_fetch
+    start = time.perf_counter()
+    if args.run_phase == 'places':
+        gatherer.get_places_loc(args.circle_radius, CITY, args.area_radius,
+                                max_concurrent=args.max_concurrent,
+                                strategy=args.strategy)
+    elif args.run_phase == 'update':
+        gatherer.update_places(max_concurrent=args.max_concurrent)
+    elif args.run_phase == 'events':
+        gatherer.get_events_from_places(max_concurrent=args.max_concurrent)
+    elapsed = time.perf_counter() - start
+    gatherer.close()
+
+    print(json.dumps({
+        'phase': args.run_phase,
+        'seconds': elapsed,
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': (statistics.mean(latencies) * 1000 if latencies else 0),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'dead_letters': len(gatherer.dead_letters),
+        'places': len(storage.get_all_place_ids()),
+        'events': len(storage.get_all_event_ids()),
+    }))
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f'{url}__stats') as response:
+                return json.load(response)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    fake_graph.add_arguments(argparser)
+    argparser.add_argument('--port', type=int, default=8089)
+    argparser.add_argument('--phases', default=','.join(PHASES),
+                           help='Comma separated phases to run, in order.')
+    argparser.add_argument('--strategy', choices=['grid', 'adaptive'],
+                           default='grid')
+    argparser.add_argument('--circle-radius', type=float, default=500)
+    argparser.add_argument('--rate-limit', type=float, default=200.0,
+                           help='Client side requests per second.')
+    argparser.add_argument('--max-concurrent', type=int, default=10)
+    argparser.add_argument('--max-retries', type=int, default=5)
+    argparser.add_argument('--json', dest='json_path', default=None,
+                           help='Also save the results to this file.')
+    # Internal, used for the per phase processes
+    argparser.add_argument('--run-phase', choices=PHASES,
+                           help=argparse.SUPPRESS)
+    argparser.add_argument('--graph-url', help=argparse.SUPPRESS)
+    argparser.add_argument('--db', help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    if args.run_phase:
+        return run_phase(args)
+
+    server_args = [
+        sys.executable, os.path.join(BENCHMARKS, 'fake_graph.py'),
+        '--port', str(args.port), '--places', str(args.places),
+        '--area-radius', str(args.area_radius),
+        '--events-per-place', str(args.events_per_place),
+        '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+        '--seed', str(args.seed),
+    ]
+    if args.server_rate_limit:
+        server_args += ['--server-rate-limit', str(args.server_rate_limit)]
+    graph_url = f'http://127.0.0.1:{args.port}/'
+    server = subprocess.Popen(server_args, stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for(graph_url)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, 'benchmark.sqlite')
+            for phase in args.phases.split(','):
+                out = subprocess.run(
+                    [sys.executable, __file__] + sys.argv[1:] +
+                    ['--run-phase', phase, '--graph-url', graph_url,
+                     '--db', db],
+                    check=True, stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL, universal_newlines=True,
+                ).stdout
+                results.append(json.loads(out.strip().splitlines()[-1]))
+        stats = wait_for(graph_url)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f'{"phase":8} {"requests":>8} {"seconds":>8} {"req/s":>8} '
+          f'{"p50 ms":>8} {"p99 ms":>8} {"RSS MB":>8} {"failed":>6}')
+    for result in results:
+        print(f'{result["phase"]:8} {result["requests"]:8d} '
+              f'{result["seconds"]:8.2f} '
+              f'{result["requests_per_second"]:8.1f} '
+              f'{result["p50_ms"]:8.1f} {result["p99_ms"]:8.1f} '
+              f'{result["peak_rss_mb"]:8.1f} {result["dead_letters"]:6d}')
+    print(f'server: {json.dumps(stats)}')
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'args': vars(args), 'phases': results,
+                       'server': stats}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+'''
+Local stand-in for the parts of the Graph API used by the Gatherer: place
+search, multi-ID place details and place events, all with paging. The
+world is synthetic and seeded, so every run serves the same data.
+
+    python benchmarks/fake_graph.py --port 8089 --places 2000 --latency 0.05
+
+Point a Gatherer at it with graph_url='http://127.0.0.1:8089/'.
+'''
+# STL imports
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import math
+import random
+import threading
+import time
+
+# Package imports
+from aiohttp import web
+
+CENTER = (51.1079, 17.0385)
+EPOCH = datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc)
+TOPICS = [{'id': f'topic{i}', 'name': f'Topic {i}'} for i in range(20)]
+
+
+def top_level_fields(fields):
+    # 'id,location,cover.fields(id,source)' -> {'id', 'location', 'cover'}
+    names, depth, current = set(), 0, ''
+    for char in fields + ',':
+        if char in '({':
+            depth += 1
+        elif char in ')}':
+            depth -= 1
+        if char == ',' and depth == 0:
+            name = current.strip()
+            for separator in '.({':
+                name = name.split(separator)[0]
+            if name:
+                names.add(name)
+            current = ''
+        else:
+            current += char
+    return names
+
+
+def project(obj, fields):
+    if not fields:
+        return obj
+    wanted = top_level_fields(fields) | {'id'}
+    return {key: value for key, value in obj.items() if key in wanted}
+
+
+class World:
+    '''
+    Places scattered uniformly over a disk around center, each with a
+    seeded number of events spread over two years
+    '''
+
+    def __init__(self, places=2000, radius=3000, events_per_place=10,
+                 center=CENTER, seed=0):
+        rand = random.Random(seed)
+        lat0, lon0 = center
+        met_per_lat = 111132.92
+        met_per_lon = 111412.84 * math.cos(math.radians(lat0))
+        self.places = {}
+        self.events = {}
+        for i in range(places):
+            r = radius * math.sqrt(rand.random())
+            angle = rand.uniform(0, 2 * math.pi)
+            place_id = str(100000 + i)
+            self.places[place_id] = {
+                'id': place_id,
+                'name': f'Place {i}',
+                'place_type': 'PLACE',
+                'place_topics': {'data': rand.sample(TOPICS, 2)},
+                'location': {
+                    'latitude': lat0 + r * math.sin(angle) / met_per_lat,
+                    'longitude': lon0 + r * math.cos(angle) / met_per_lon,
+                    'city': 'Wroclaw',
+                    'country': 'Poland',
+                    'street': f'Street {i}',
+                    'zip': '50-000',
+                },
+                'cover': {'id': f'c{i}', 'source': 'x' * 200},
+                'picture': {'data': {'url': 'y' * 200}},
+            }
+            count = rand.randint(0, 2 * events_per_place)
+            starts = sorted(rand.uniform(0, 2 * 365 * 24 * 3600)
+                            for _ in range(count))
+            self.events[place_id] = [{
+                'id': f'{place_id}_{j}',
+                'name': f'Event {j} at {place_id}',
+                'description': 'z' * rand.randint(50, 500),
+                'start_time': (EPOCH + datetime.timedelta(seconds=start))
+                .strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'timestamp': EPOCH.timestamp() + start,
+                'ticket_uri': 'https://tickets.example/1',
+                'attending_count': rand.randint(0, 1000),
+            } for j, start in enumerate(starts)]
+
+    def search(self, lat, lon, distance):
+        met_per_lat = 111132.92
+        met_per_lon = 111412.84 * math.cos(math.radians(lat))
+        return [
+            place_id for place_id, place in self.places.items()
+            if math.hypot(
+                (place['location']['latitude'] - lat) * met_per_lat,
+                (place['location']['longitude'] - lon) * met_per_lon,
+            ) <= distance
+        ]
+
+
+class FakeGraph:
+    '''
+    aiohttp application serving a World with a configurable latency,
+    share of failing requests and request rate limit
+    '''
+
+    def __init__(self, world, latency=0.0, jitter=0.5, error_rate=0.0,
+                 rate_limit=None, page_size=25, seed=0):
+        self.world = world
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.recent = collections.deque()
+        self.stats = collections.Counter()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/__stats', self.handle_stats)
+        app.router.add_get('/{tail:.*}', self.handle)
+        return app
+
+    def _usage(self):
+        # Share of the rate limit used over the last second
+        now = time.monotonic()
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - 1:
+            self.recent.popleft()
+        if not self.rate_limit:
+            return 0
+        return int(100 * len(self.recent) / self.rate_limit)
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    async def handle(self, request):
+        self.stats['requests'] += 1
+        usage = self._usage()
+        headers = {'X-App-Usage': json.dumps({
+            'call_count': min(usage, 100),
+            'total_time': min(usage, 100) // 2,
+            'total_cputime': min(usage, 100) // 2,
+        })}
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(
+                1 - self.jitter, 1 + self.jitter))
+        if usage > 100:
+            self.stats['throttled'] += 1
+            return web.json_response({'error': {
+                'code': 4, 'message': 'Application request limit reached',
+                'type': 'OAuthException', 'is_transient': True,
+            }}, status=400, headers=headers)
+        if self.random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response({'error': {
+                'code': 2, 'message': 'Service temporarily unavailable',
+                'type': 'OAuthException', 'is_transient': True,
+            }}, status=500, headers=headers)
+
+        query = request.query
+        path = request.path.strip('/')
+        if path == 'search':
+            lat, lon = map(float, query['center'].split(','))
+            ids = self.world.search(lat, lon, float(query['distance']))
+            body = self._page(request, [{'id': id_} for id_ in ids])
+        elif not path and 'ids' in query:
+            body = {
+                id_: project(self.world.places[id_], query.get('fields'))
+                for id_ in query['ids'].split(',')
+                if id_ in self.world.places
+            }
+        elif path.endswith('/events'):
+            events = self.world.events.get(path.split('/')[0], [])
+            if 'since' in query:
+                events = [event for event in events
+                          if event['timestamp'] >= float(query['since'])]
+            if 'until' in query:
+                events = [event for event in events
+                          if event['timestamp'] <= float(query['until'])]
+            events = [project(event, query.get('fields'))
+                      for event in events]
+            body = self._page(request, events)
+        else:
+            self.stats['not_found'] += 1
+            return web.json_response({'error': {
+                'code': 100, 'message': f'Unknown path {request.path}',
+                'type': 'GraphMethodException',
+            }}, status=404, headers=headers)
+        return web.json_response(body, headers=headers)
+
+    def _page(self, request, items):
+        limit = int(request.query.get('limit', self.page_size))
+        offset = int(request.query.get('after', 0))
+        body = {'data': items[offset:offset + limit]}
+        if offset + limit < len(items):
+            url = request.url.update_query(after=str(offset + limit))
+            body['paging'] = {
+                'cursors': {'after': str(offset + limit)},
+                'next': str(url),
+            }
+        return body
+
+    def start(self, host='127.0.0.1', port=8089):
+        '''
+        Serves in a background thread, returns the base url
+        '''
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(self.app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        return f'http://{host}:{port}/'
+
+
+def add_arguments(argparser):
+    argparser.add_argument('--places', type=int, default=2000,
+                           help='Number of synthetic places.')
+    argparser.add_argument('--area-radius', type=float, default=3000,
+                           help='Radius (meters) of the area with places.')
+    argparser.add_argument('--events-per-place', type=int, default=10,
+                           help='Average number of events per place.')
+    argparser.add_argument('--latency', type=float, default=0.02,
+                           help='Mean response latency in seconds.')
+    argparser.add_argument('--error-rate', type=float, default=0.0,
+                           help='Share of requests failing with HTTP 500.')
+    argparser.add_argument('--server-rate-limit', type=float, default=None,
+                           help='Requests per second before throttling.')
+    argparser.add_argument('--seed', type=int, default=0,
+                           help='Seed of the world and of the errors.')
+
+
+def from_args(args):
+    world = World(args.places, args.area_radius, args.events_per_place,
+                  seed=args.seed)
+    return FakeGraph(world, latency=args.latency, error_rate=args.error_rate,
+                     rate_limit=args.server_rate_limit, seed=args.seed)
+
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description=__doc__.strip())
+    argparser.add_argument('--port', type=int, default=8089)
+    add_arguments(argparser)
+    args = argparser.parse_args()
+    web.run_app(from_args(args).app(), host='127.0.0.1', port=args.port,
+                access_log=None)
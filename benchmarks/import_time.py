@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+'''
+Import time regression check, run from the repository root:
+
+    python benchmarks/import_time.py
+
+Every statement is run in a fresh interpreter. The check fails if it takes
+longer than its budget or loads one of the modules it must not load.
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY = ['aiohttp', 'sqlalchemy', 'numpy', 'geopy', 'matplotlib', 'bokeh',
+         'gmplot']
+
+# (statement, budget in seconds, modules it must not load)
+CHECKS = [
+    ('import fbd', 0.15, HEAVY),
+    ('import fbd.tools', 0.15, HEAVY),
+    ('from fbd import Storage', 1.0,
+     ['aiohttp', 'numpy', 'geopy', 'matplotlib', 'bokeh', 'gmplot']),
+    ('from fbd import Gatherer', 1.5,
+     ['sqlalchemy', 'geopy', 'matplotlib', 'bokeh', 'gmplot']),
+    ('from fbd import Visualizer', 1.5,
+     ['aiohttp', 'numpy', 'geopy', 'matplotlib', 'bokeh', 'gmplot']),
+]
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+print(' '.join(sorted(name for name in sys.modules if '.' not in name)))
+'''
+
+
+def measure(statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE.format(statement=statement)],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True,
+        ).stdout.splitlines()
+        timings.append(float(out[0]))
+    return statistics.median(timings), set(out[1].split())
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.strip())
+    argparser.add_argument('-n', '--repeat', type=int, default=5,
+                           help='Runs per statement, the median is used.')
+    argparser.add_argument('-s', '--scale', type=float, default=1.0,
+                           help='Multiplies the time budgets, '
+                           'for slow machines.')
+    args = argparser.parse_args()
+
+    failed = False
+    for statement, budget, forbidden in CHECKS:
+        median, modules = measure(statement, args.repeat)
+        loaded = sorted(set(forbidden) & modules)
+        ok = median <= budget * args.scale and not loaded
+        failed |= not ok
+        print(f'{"ok" if ok else "FAIL":4} {statement:28} {median * 1000:7.1f}ms'
+              f' (budget {budget * args.scale * 1000:.0f}ms)'
+              + (f' loaded {", ".join(loaded)}' if loaded else ''))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
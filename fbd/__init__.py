@@ -1,4 +1,28 @@
-from fbd import gatherer, storage, tools, visualizer
-from fbd.gatherer import Gatherer
-from fbd.storage import Storage
-from fbd.visualizer import Visualizer
+# The submodules are imported on first access (PEP 562), so that importing
+# fbd doesn't load aiohttp, SQLAlchemy or the plotting libraries up front
+import importlib
+
+_SUBMODULES = {'gatherer', 'storage', 'tools', 'visualizer'}
+
+_ATTRIBUTES = {
+    'Gatherer': 'gatherer',
+    'Storage': 'storage',
+    'Visualizer': 'visualizer',
+}
+
+__all__ = sorted(_SUBMODULES | set(_ATTRIBUTES))
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    if name in _ATTRIBUTES:
+        module = importlib.import_module(f'{__name__}.{_ATTRIBUTES[name]}')
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,132 @@
+# STL imports
+import json
+import logging
+import os
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Package imports
+import requests
+
+GRAPH_URL = 'https://graph.facebook.com/v2.9/'
+
+# Graph API error code of invalid/expired access tokens
+INVALID_TOKEN_CODE = 190
+
+
+def find_token(url, params):
+    if params and 'access_token' in params:
+        return params['access_token']
+    return dict(parse_qsl(urlsplit(url).query)).get('access_token')
+
+
+def swap_token(url, params, token):
+    # Puts the new token wherever the old one was, paging urls carry it in
+    # their query string
+    if params and 'access_token' in params:
+        params = dict(params, access_token=token)
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if any(key == 'access_token' for key, _ in query):
+        query = [(key, token if key == 'access_token' else value)
+                 for key, value in query]
+        url = urlunsplit(parts._replace(query=urlencode(query)))
+    return url, params
+
+
+class AppToken:
+    '''
+    App access token acquired on first use. By default it's derived from
+    the app credentials ("client_id|client_secret") without any request,
+    otherwise it's fetched from the OAuth endpoint and persisted to path
+    together with its expiry, so later runs can reuse it.
+    '''
+
+    def __init__(self, client_id, client_secret, path=None, derive=True,
+                 graph_url=GRAPH_URL, logger=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.path = path
+        self.derive = derive
+        self.graph_url = graph_url
+        self.logger = logger if logger else logging
+        self._token = None
+        self._expires_at = None
+
+    @property
+    def value(self):
+        if self._token is None or self._expired():
+            self._token, self._expires_at = self._load() or self._fetch()
+        return self._token
+
+    def _expired(self):
+        # A minute of margin so the token doesn't expire mid-request
+        return (self._expires_at is not None and
+                time.time() > self._expires_at - 60)
+
+    def _load(self):
+        if self.derive or not self.path:
+            return None
+        try:
+            with open(self.path, 'r') as f:
+                entry = json.load(f).get(str(self.client_id))
+        except (OSError, ValueError):
+            return None
+        if not entry:
+            return None
+        token = entry['access_token'], entry.get('expires_at')
+        if token[1] is not None and time.time() > token[1] - 60:
+            return None
+        return token
+
+    def _save(self):
+        try:
+            with open(self.path, 'r') as f:
+                tokens = json.load(f)
+        except (OSError, ValueError):
+            tokens = {}
+        tokens[str(self.client_id)] = {
+            'access_token': self._token,
+            'expires_at': self._expires_at,
+        }
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                          0o600), 'w') as f:
+            json.dump(tokens, f)
+        os.replace(tmp_path, self.path)
+
+    def _fetch(self):
+        if self.derive:
+            return f'{self.client_id}|{self.client_secret}', None
+        self.logger.debug('AppToken: Getting the token')
+        response = requests.get(
+            f'{self.graph_url}oauth/access_token',
+            params={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials'
+            }).json()
+        if 'access_token' not in response:
+            raise Exception(f'AppToken: Couldn\'t get a token - {response}')
+        expires_in = response.get('expires_in')
+        token = (response['access_token'],
+                 time.time() + expires_in if expires_in else None)
+        if self.path:
+            self._token, self._expires_at = token
+            self._save()
+        return token
+
+    def refresh(self, stale):
+        '''
+        Replaces the stale token after an invalid token error, returns
+        whether a different token is now available
+        '''
+        if self._token == stale:
+            self._token = self._expires_at = None
+            if not self.derive:
+                try:
+                    self._token, self._expires_at = self._fetch()
+                except Exception as e:
+                    self.logger.error(f'AppToken: Refresh failed - {e}')
+                    return False
+        return self.value != stale
@@ -0,0 +1,75 @@
+# STL imports
+import asyncio
+import logging
+
+# Graph API limit for both the ?ids= form and batch requests
+MAX_BATCH_SIZE = 50
+
+
+def chunks(items, size=MAX_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class IdBatcher:
+    '''
+    Coalesces single-object lookups into multi-ID Graph requests.
+
+    fetch is a coroutine function which receives a list of at most
+    batch_size ids and returns a dict mapping the ids to their objects.
+    Callers simply await get(id) and get their own object (or None) back.
+    '''
+
+    def __init__(self, fetch, batch_size=MAX_BATCH_SIZE, delay=0.05,
+                 logger=None):
+        self.fetch = fetch
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.delay = delay
+        self.logger = logger if logger else logging
+        self._pending = {}
+        self._flush_handle = None
+
+    async def get(self, id_):
+        future = asyncio.get_event_loop().create_future()
+        self._pending.setdefault(id_, []).append(future)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                self.delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        asyncio.ensure_future(self._fetch_batch(batch))
+
+    async def _fetch_batch(self, batch):
+        self.logger.debug(f'IdBatcher: Fetching a batch of {len(batch)} ids')
+        try:
+            results = await self.fetch(list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for id_, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results.get(id_))
+
+    async def get_many(self, ids):
+        '''
+        Fetches a known list of ids directly in full-size batches
+        '''
+        results = {}
+        for batch_result in await asyncio.gather(
+                *[self.fetch(batch) for batch in chunks(ids, self.batch_size)]):
+            results.update(batch_result)
+        return results
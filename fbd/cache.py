@@ -0,0 +1,135 @@
+# STL imports
+import hashlib
+import logging
+import os
+import re
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DAY = 24 * 60 * 60
+
+# Seconds after which the cached responses of an endpoint are stale
+DEFAULT_TTLS = {
+    'search': 7 * DAY,
+    'details': DAY,
+    'events': 6 * 60 * 60,
+    'reactions': 10 * 60,
+    'default': DAY,
+}
+
+# The paging urls of the responses carry the access token, which holds the
+# app secret
+TOKEN_PARAM = re.compile(rb'access_token=[^&"\\\s]*&?')
+
+
+def normalize_url(url, params=None):
+    # Same request -> same key, whatever the token or the parameter order
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + [(key, str(value)) for key, value
+                                      in (params or {}).items()]
+    query = sorted((key, value) for key, value in query
+                   if key != 'access_token')
+    return urlunsplit(parts._replace(query=urlencode(query), fragment=''))
+
+
+def endpoint(url, params=None):
+    path = urlsplit(url).path
+    if path.endswith('/search'):
+        return 'search'
+    if path.endswith('/events'):
+        return 'events'
+    if 'reactions' in (params or {}).get('fields', url):
+        return 'reactions'
+    if 'ids' in (params or {}) or 'ids=' in url:
+        return 'details'
+    return 'default'
+
+
+class ResponseCache:
+    '''
+    Content-addressed on-disk cache of Graph API responses.
+
+    Entries are zlib compressed files named after the hash of the
+    normalized request, expire after the TTL of their endpoint and the
+    least recently used ones are evicted once the cache grows over
+    max_size bytes. Access tokens are stripped from the stored bodies and
+    the entries are only readable by their owner.
+    '''
+
+    def __init__(self, path='.fbd_cache', max_size=512 * 1024 * 1024,
+                 ttls=None, logger=None):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.logger = logger if logger else logging
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        for subdir in os.scandir(self.path):
+            if subdir.is_dir():
+                yield from os.scandir(subdir.path)
+
+    def _file(self, url, params):
+        key = hashlib.sha256(normalize_url(url, params).encode()).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, url, params=None):
+        # Returns the raw response body (bytes) or None
+        fpath = self._file(url, params)
+        try:
+            with open(fpath, 'rb') as f:
+                stored, body = zlib.decompress(f.read()).split(b'\n', 1)
+        except (OSError, zlib.error, ValueError):
+            self.misses += 1
+            return None
+        if time.time() - float(stored) > self.ttls[endpoint(url, params)]:
+            self.misses += 1
+            return None
+        # The modification time serves as the last access time for the LRU
+        os.utime(fpath)
+        self.hits += 1
+        return body
+
+    def put(self, url, params, body):
+        fpath = self._file(url, params)
+        if isinstance(body, str):
+            body = body.encode()
+        body = TOKEN_PARAM.sub(b'', body)
+        data = zlib.compress(f'{time.time()}\n'.encode() + body)
+        os.makedirs(os.path.dirname(fpath), mode=0o700, exist_ok=True)
+        try:
+            self.size -= os.path.getsize(fpath)
+        except OSError:
+            pass
+        tmp_path = f'{fpath}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, fpath)
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self, target=0.9):
+        # Removes the least recently used entries until the cache takes
+        # less than target * max_size bytes
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size,
+                          entry.path) for entry in self._entries())
+        for _, size, path in entries:
+            if self.size <= self.max_size * target:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+        self.logger.debug(f'ResponseCache: Evicted down to {self.size} bytes')
+
+    def clear(self):
+        for entry in list(self._entries()):
+            os.remove(entry.path)
+        self.size = 0
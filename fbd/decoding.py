@@ -0,0 +1,46 @@
+# STL imports
+import json
+
+# orjson is optional, it parses several times faster than the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(body):
+    # Both parsers take the raw response bytes, no intermediate str
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def project(data, drop):
+    # Removes the dropped keys from every object in the document
+    if isinstance(data, dict):
+        return {key: project(value, drop) for key, value in data.items()
+                if key not in drop}
+    if isinstance(data, list):
+        return [project(value, drop) for value in data]
+    return data
+
+
+class Decoder:
+    '''
+    Decodes Graph API responses straight from their bytes. The fields in
+    drop are projected out of the document right after parsing, so the
+    unused blobs don't travel through the pipeline queues.
+    '''
+
+    def __init__(self, drop=()):
+        self.drop = frozenset(drop)
+
+    @property
+    def backend(self):
+        return 'orjson' if orjson is not None else 'json'
+
+    def decode(self, body):
+        data = loads(body)
+        if self.drop:
+            data = project(data, self.drop)
+        return data
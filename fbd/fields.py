@@ -0,0 +1,49 @@
+# Named field selections of the Graph objects, from the smallest payload
+# to everything the gatherer knows about:
+#  - minimal: enough to identify and locate the objects
+#  - storage: exactly what fbd.storage persists
+#  - full: also the cover, the attendance counts etc.
+REACTION_TYPES = ('like', 'love', 'haha', 'wow', 'sad', 'angry', 'thankful')
+
+# One aliased summary per reaction type, e.g. like.summary.total_count
+REACTION_FIELDS = ','.join(
+    f'reactions.type({reaction.upper()}).limit(0).summary(total_count)'
+    f'.as({reaction})' for reaction in REACTION_TYPES)
+
+PROFILES = {
+    'place': {
+        'minimal': 'id,name,location',
+        'storage': 'id,name,place_type,place_topics,location',
+        'full': ('id,name,place_type,place_topics,'
+                 'cover.fields(id,source),picture.type(large),location'),
+    },
+    'event': {
+        'minimal': 'id,name,start_time',
+        'storage': ('id,name,start_time,description,ticket_uri,'
+                    'picture.type(large)'),
+        'full': ('id,name,start_time,description,place,type,category,'
+                 'ticket_uri,cover.fields(id,source),picture.type(large),'
+                 'attending_count,declined_count,maybe_count,noreply_count'),
+    },
+    'page': {
+        'minimal': 'id,name',
+        'storage': 'id,name,about,category,fan_count',
+        'full': ('id,name,about,category,fan_count,link,location,'
+                 'cover.fields(id,source),picture.type(large)'),
+    },
+    'post': {
+        'minimal': 'id,created_time',
+        'storage': f'id,message,link,created_time,{REACTION_FIELDS}',
+        'full': (f'id,message,link,created_time,type,story,'
+                 f'shares,{REACTION_FIELDS}'),
+    },
+}
+
+PROFILE_NAMES = ('minimal', 'storage', 'full')
+
+
+def get_fields(kind, profile='full'):
+    try:
+        return PROFILES[kind][profile]
+    except KeyError:
+        raise ValueError(f'Unknown {kind} field profile: {profile}')
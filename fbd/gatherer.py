@@ -1,25 +1,52 @@
 # STL imports
 # Package imports
 import asyncio
+import calendar
+import concurrent.futures
+import datetime
 import json
 import logging
 import sys
+import time
+from urllib.parse import urlsplit
 
 import aiohttp
 import async_timeout
-import numpy as np
 import requests
-from tqdm import tqdm, trange  # Progress bar
 
 import fbd.tools
-from fbd.storage import Storage
+from fbd.auth import INVALID_TOKEN_CODE, AppToken, find_token, swap_token
+from fbd.batching import IdBatcher, chunks
+from fbd.cache import endpoint
+from fbd.decoding import Decoder
+from fbd.fields import (PROFILE_NAMES, REACTION_FIELDS, REACTION_TYPES,
+                        get_fields)
+from fbd.grid import HexGrid
+from fbd.limiter import THROTTLE_CODES, RateLimiter
+from fbd.metrics import REGISTRY
+from fbd.progress import ProgressReporter
+from fbd.quadtree import initial_cells
+from fbd.retry import (DeadLetters, GraphError, ServerError, backoff_delay,
+                       strip_token)
+
+# Errors of a request which failed for good
+FETCH_ERRORS = (GraphError, aiohttp.ClientError, asyncio.TimeoutError,
+                ServerError, ValueError)
 
 
 class Gatherer:
     # TODO: Move to numpy arrays / DFs?
-    # TODO: Store the already processed points as a table in a db for faster
-    # --get-places
-    def __init__(self, client_id, client_secret, storage=None, logger=None):
+    GRAPH_URL = 'https://graph.facebook.com/v2.9/'
+
+    def __init__(self, client_id, client_secret, storage=None, logger=None,
+                 connection_limit=100, connection_limit_per_host=0,
+                 keepalive_timeout=30, dns_cache_ttl=300, rate_limit=50.0,
+                 max_concurrency=100, max_retries=5, checkpoint_size=100,
+                 pipeline_workers=50, queue_size=100, save_batch_size=500,
+                 cache=None, decoder=None, place_fields='full',
+                 event_fields='full', page_fields='storage',
+                 post_fields='storage', token_cache=None, derive_token=True,
+                 graph_url=None, metrics=None, progress=None):
         if not logger:
             logging.basicConfig(level=logging.INFO)
             logging.info('Gatherer: Didn\'t receive a custom logger,'
@@ -31,25 +58,71 @@ class Gatherer:
         self.logger.debug('Gatherer: Started initialization')
         self.client_id = client_id
         self.client_secret = client_secret
-        self.logger.debug('Gatherer: Getting the token')
-        token_params = {
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'grant_type': 'client_credentials'
-        }
-        self.token = requests.get(
-            'https://graph.facebook.com/v2.9/oauth/access_token?',
-            params=token_params).json()['access_token']
+        # Another Graph API endpoint, e.g. a local fake one for benchmarks
+        if graph_url:
+            self.GRAPH_URL = graph_url
+        # The token is only acquired once a request needs it
+        self.auth = AppToken(client_id, client_secret, path=token_cache,
+                             derive=derive_token, graph_url=self.GRAPH_URL,
+                             logger=self.logger)
         self.logger.debug('Gatherer: Initialized')
         self.storage = storage
-        self.PLACE_ID_DETAILS_URL = ('https://graph.facebook.com/v2.9/{}'
-                                     '?fields=id,name,place_type,place_topics,'
-                                     'cover.fields(id,source),picture.type(large),'
-                                     f'location&access_token={self.token}')
-        self.PLACE_LAT_LON_RADIUS_URL = ('https://graph.facebook.com/v2.9/'
+        # Optional fbd.cache.ResponseCache sitting under get_json/get_text
+        self.cache = cache
+        # Turns the response bytes into JSON, see fbd.decoding
+        self.decoder = decoder if decoder else Decoder()
+        # Request counts, latencies etc., see fbd.metrics
+        self.metrics = metrics if metrics else REGISTRY
+        # Progress bars or log lines, see fbd.progress
+        self.progress = (progress if progress
+                         else ProgressReporter(logger=self.logger))
+        # Field profiles (see fbd.fields) of the place details and events,
+        # can be switched between the phases of a run
+        self.place_fields = place_fields
+        self.event_fields = event_fields
+        self.page_fields = page_fields
+        self.post_fields = post_fields
+        # Connection pool settings, the session itself is created lazily
+        # on the Gatherer's loop and shared by every phase of a run
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.loop = None
+        self.session = None
+        # Single thread running the storage writes of the async paths
+        self._writer = None
+        # Shared by every fetch path, adapts to the Graph API usage headers
+        self.limiter = RateLimiter(rate=rate_limit,
+                                   max_concurrency=max_concurrency,
+                                   logger=self.logger)
+        # Requests which kept failing after max_retries attempts
+        self.max_retries = max_retries
+        self.dead_letters = DeadLetters()
+        # Sizes of the get_places_loc pipeline stages
+        self.pipeline_workers = pipeline_workers
+        self.queue_size = queue_size
+        self.save_batch_size = save_batch_size
+        # Crawl state of get_places_loc, see _checkpoint
+        self.checkpoint_size = checkpoint_size
+        self._crawl = None
+        self._crawl_state = {}
+        self._stale_before = None
+        self._pending_cells = []
+        # Place ids whose details were already fetched during this run
+        self.seen_place_ids = set()
+        # Place details are fetched through the multi-ID ?ids= form
+        self.place_batcher = IdBatcher(
+            lambda ids: self.get_json_ids(
+                ids, get_fields('place', self.place_fields)),
+            logger=self.logger)
+        self.PLACE_LAT_LON_RADIUS_URL = (f'{self.GRAPH_URL}'
                                          'search?type=place&q="*"&center={},{}'
-                                         '&distance={}&fields=id&'
-                                         f'access_token={self.token}''')
+                                         '&distance={}&fields=id')
+
+    @property
+    def token(self):
+        return self.auth.value
 
     @staticmethod
     def _clean_url(url):
@@ -61,53 +134,86 @@ class Gatherer:
 
     @staticmethod
     def _response_to_post(post, page_id):
-        return {
-            'id': post['id'],
-            'page_id': page_id,
-            'message': post['message'],
-            'created_time': post['created_time'],
-            'link': post['link'],
-            'like': post['like']['summary']['total_count'],
-            'love': post['love']['summary']['total_count'],
-            'haha': post['haha']['summary']['total_count'],
-            'wow': post['wow']['summary']['total_count'],
-            'sad': post['sad']['summary']['total_count'],
-            'angry': post['angry']['summary']['total_count'],
-            'thankful': post['thankful']['summary']['total_count'],
+        # Only the downloaded fields are kept, so that the storage doesn't
+        # overwrite the others (see fbd.storage.Post.SOURCE_FIELDS)
+        post_dict = {
+            key: post[key] for key in ('message', 'created_time', 'link')
+            if key in post
         }
+        post_dict.update(id=post['id'], page_id=page_id)
+        for reaction in REACTION_TYPES:
+            if reaction in post:
+                post_dict[reaction] = (post[reaction].get('summary', {})
+                                       .get('total_count'))
+        return post_dict
 
-    # Generator
     @staticmethod
     def _generate_points(radius, circle_radius, center_point_lat,
                          center_point_lng):
-        # Defining the general square bounds
-        top = center_point_lat + fbd.tools.lat_from_met(radius)
-        bottom = center_point_lat - fbd.tools.lat_from_met(radius)
-        left = center_point_lng - fbd.tools.lon_from_met(radius)
-        right = center_point_lng + fbd.tools.lon_from_met(radius)
-
-        circle_step = (fbd.tools.lat_from_met(circle_radius),
-                       fbd.tools.lon_from_met(circle_radius))
-
-        lat = top
-        lng = left
-
-        # Iterating by small circles from top->bottom from left->right
-        while lat >= bottom:
-            while lng <= right:
-                yield lat, lng
-                lng += circle_step[1]
-            lng = left
-            lat -= circle_step[0]
+        return iter(HexGrid(radius, circle_radius, center_point_lat,
+                            center_point_lng))
 
     @staticmethod
     def _num_iters(radius, circle_radius, center_point_lat, center_point_lng):
-        # Exhaust the _generate_points generator and count the # circles
-        return len([
-            x
-            for x, _ in Gatherer._generate_points(
-                radius, circle_radius, center_point_lat, center_point_lng)
-        ])
+        return len(HexGrid(radius, circle_radius, center_point_lat,
+                           center_point_lng))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_loop(self):
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+        return self.loop
+
+    def _run(self, coro):
+        return self._get_loop().run_until_complete(coro)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.logger.debug('Gatherer: Creating the client session')
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'Accept-Encoding': 'gzip, deflate'},
+            )
+        return self.session
+
+    async def _write(self, method, *args):
+        # Storage writes run on a dedicated thread (with its own storage
+        # session) so that the commits don't stall the requests in flight.
+        # One thread keeps the writes in order
+        if self._writer is None:
+            self._writer = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='fbd-writer')
+        return await asyncio.get_event_loop().run_in_executor(
+            self._writer, method, *args)
+
+    def close(self):
+        if self._writer is not None:
+            close_session = getattr(self.storage, 'close_session', None)
+            if close_session:
+                self._writer.submit(close_session)
+            self._writer.shutdown()
+            self._writer = None
+        self.logger.debug('Gatherer: Closing the client session')
+        if self.session is not None and not self.session.closed:
+            self._run(self.session.close())
+        self.session = None
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+        self.loop = None
 
     def _exit(self):
         self.logger.info('Gatherer - _exit: EXITING APPLICATION')
@@ -121,338 +227,935 @@ class Gatherer:
             'Gatherer: Get place request, id={0}'.format(place_id))
         params = {
             'ids': place_id,
-            'fields': 'id,name,place_type,place_topics,cover.fields(id,source),'
-                      'picture.type(large),location',
+            'fields': get_fields('place', self.place_fields),
             'access_token': self.token
         }
-        place = requests.get('https://graph.facebook.com/v2.9/',
+        place = requests.get(self.GRAPH_URL,
                              params=params).json()[place_id]
         if save_storage:
             self.storage.update_place(place)
         return place
 
-    @staticmethod
-    async def get_json(url, session, sem, params=None, timeout=15):
-        async with sem:
+    async def _fetch(self, url, params, timeout, as_json):
+        kind = endpoint(url, params)
+        # Cache hits don't count towards the rate limits
+        if self.cache is not None:
+            body = self.cache.get(url, params)
+            if body is not None:
+                self.metrics.inc('fbd_cache_hits_total', endpoint=kind)
+                return self.decoder.decode(body) if as_json else body.decode()
+        async with self.limiter:
             with async_timeout.timeout(timeout):
-                async with session.get(url, params=params) as response:
-                    return json.loads(await response.text())
+                start = time.perf_counter()
+                async with self._get_session().get(
+                        url, params=params) as response:
+                    body = await response.read()
+                    self._record_response(kind, response, body, start)
+                    if not as_json:
+                        self.limiter.feedback(response.headers)
+                        if response.status >= 500:
+                            raise ServerError(f'HTTP {response.status}')
+                        if self.cache is not None and response.status < 400:
+                            self.cache.put(url, params, body)
+                        return body.decode(response.charset or 'utf-8')
+                    data = self.decoder.decode(body)
+                    error = data.get('error') if isinstance(data,
+                                                            dict) else None
+                    self.limiter.feedback(response.headers, error)
+                    if error:
+                        if error.get('code') in THROTTLE_CODES:
+                            self.metrics.inc('fbd_throttled_total',
+                                             endpoint=kind)
+                        raise GraphError(error)
+                    if response.status >= 500:
+                        raise ServerError(f'HTTP {response.status}')
+                    if self.cache is not None and response.status < 400:
+                        self.cache.put(url, params, body)
+                    return data
 
-    @staticmethod
-    async def get_text(url, session, sem, params=None, timeout=15):
-        async with sem:
-            with async_timeout.timeout(timeout):
-                async with session.get(url, params=params) as response:
-                    return await response.text()
+    def _record_response(self, kind, response, body, start):
+        self.metrics.observe('fbd_request_seconds',
+                             time.perf_counter() - start, endpoint=kind)
+        self.metrics.inc('fbd_requests_total', endpoint=kind,
+                         status=response.status)
+        self.metrics.inc('fbd_response_bytes_total', len(body), endpoint=kind)
+        self.metrics.set('fbd_limiter_concurrency', self.limiter.concurrency)
+        self.metrics.set('fbd_limiter_rate', self.limiter.rate)
 
-    @staticmethod
-    async def get_links_list(links, json=True, max_concurrent=3, desc=None):
-        sem = asyncio.Semaphore(max_concurrent)
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                asyncio.ensure_future(
-                    Gatherer.get_json(link, session, sem)
-                    if json else Gatherer.get_text(link, session, sem))
-                for link in links
-            ]
-            responses = [
-                await resp
-                for resp in tqdm(
-                    asyncio.as_completed(tasks),
-                    desc=desc,
-                    total=len(tasks),
-                )
-            ]
+    async def _fetch_with_retries(self, url, params, timeout, as_json):
+        # Raises the last error if the request failed for good
+        if url.startswith(self.GRAPH_URL) and not find_token(url, params):
+            # Paging urls read from the cache had their token stripped
+            params = dict(params or {}, access_token=self.token)
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._fetch(url, params, timeout, as_json)
+            except GraphError as e:
+                error = e
+                if e.code == INVALID_TOKEN_CODE:
+                    # Retried right away if the token could be replaced
+                    stale = find_token(url, params)
+                    if stale and self.auth.refresh(stale):
+                        url, params = swap_token(url, params, self.token)
+                        continue
+                    raise
+                if not e.retriable:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ServerError,
+                    ValueError) as e:
+                error = e
+            self.metrics.inc('fbd_request_errors_total',
+                             endpoint=endpoint(url, params),
+                             error=type(error).__name__)
+            if attempt < self.max_retries:
+                self.metrics.inc('fbd_retries_total',
+                                 endpoint=endpoint(url, params))
+                delay = backoff_delay(attempt)
+                self.logger.debug(f'Gatherer: Retrying {strip_token(url)} in '
+                                  f'{delay:.2f}s ({error!r})')
+                await asyncio.sleep(delay)
+        raise error
+
+    def _dead_letter(self, url, params, error):
+        self.logger.warning(f'Gatherer: Giving up on {strip_token(url)} - '
+                            f'{error!r}')
+        self.metrics.inc('fbd_dead_letters_total',
+                         endpoint=endpoint(url, params))
+        self.dead_letters.add(url, params, error)
+
+    async def _fetch_retrying(self, url, params, timeout, as_json):
+        # Returns None if the request failed for good, the request is then
+        # stored in the dead letters so that it can be retried later
+        try:
+            return await self._fetch_with_retries(url, params, timeout,
+                                                  as_json)
+        except FETCH_ERRORS as e:
+            self._dead_letter(url, params, e)
+            return None
+
+    async def get_json(self, url, params=None, timeout=15):
+        return await self._fetch_retrying(url, params, timeout, as_json=True)
+
+    async def get_text(self, url, params=None, timeout=15):
+        return await self._fetch_retrying(url, params, timeout, as_json=False)
+
+    async def get_json_ids(self, ids, fields):
+        # One request for up to 50 objects, the response maps ids to objects.
+        # Sorted so that the same batch always makes the same request
+        ids = sorted(ids)
+        params = {
+            'ids': ','.join(ids),
+            'fields': fields,
+            'access_token': self.token,
+        }
+        try:
+            response = await self._fetch_with_retries(
+                self.GRAPH_URL, params, 15, as_json=True)
+        except GraphError as e:
+            # One deleted or unknown id fails the whole request, the halves
+            # are retried until only the failing ids are left
+            if e.retriable or e.code == INVALID_TOKEN_CODE or len(ids) == 1:
+                self._dead_letter(self.GRAPH_URL, params, e)
+                return {}
+            self.logger.debug(f'Gatherer: Splitting a batch of {len(ids)} '
+                              f'ids - {e!r}')
+            middle = len(ids) // 2
+            results = {}
+            for half in await asyncio.gather(
+                    self.get_json_ids(ids[:middle], fields),
+                    self.get_json_ids(ids[middle:], fields)):
+                results.update(half)
+            return results
+        except FETCH_ERRORS as e:
+            self._dead_letter(self.GRAPH_URL, params, e)
+            return {}
+        return response if response else {}
+
+    async def get_links_list(self, links, json=True, max_concurrent=None,
+                             desc=None):
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        tasks = [
+            asyncio.ensure_future(
+                self.get_json(link)
+                if json else self.get_text(link))
+            for link in links
+        ]
+        responses = []
+        with self.progress.task(desc or 'Getting links', len(tasks),
+                                'link') as progress:
+            for resp in asyncio.as_completed(tasks):
+                responses.append(await resp)
+                progress.update()
         return responses
 
-    @staticmethod
-    async def get_links(links, json=True, max_concurrent=3, desc=None):
-        sem = asyncio.Semaphore(max_concurrent)
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                asyncio.ensure_future(
-                    Gatherer.get_json(link, session, sem)
-                    if json else Gatherer.get_text(link, session, sem))
-                for link in links
-            ]
-            for resp in tqdm(
-                    asyncio.as_completed(tasks),
-                    desc=desc,
-                    total=len(tasks),
-            ):
+    async def get_links(self, links, json=True, max_concurrent=None,
+                        desc=None):
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        tasks = [
+            asyncio.ensure_future(
+                self.get_json(link)
+                if json else self.get_text(link))
+            for link in links
+        ]
+        with self.progress.task(desc or 'Getting links', len(tasks),
+                                'link') as progress:
+            for resp in asyncio.as_completed(tasks):
                 yield await resp
+                progress.update()
 
-    async def _get_place_ids_point(self, lat, lon, circle_radius, session, sem):
-        # Getting the pages from graph api
-
+    async def _search_pages(self, url, params=None, max_pages=None):
+        # Returns the ids found, the number of pages read, the url of the
+        # next page if max_pages stopped the paging early and whether a
+        # request failed before the paging was over
         id_list = []
-        response = await self.get_json(
-            self.PLACE_LAT_LON_RADIUS_URL.format(lat, lon, circle_radius),
-            session, sem
-        )
-        # Quick list comprehension to extract the IDs
-        place_id_list = [i.get('id') for i in response.get('data', [{}])]
-        for id_ in place_id_list:
-            if id_:
-                id_list.append(id_)
-        next_page = 'paging' in response and 'next' in response['paging']
-        # There are multiple pages in the response
-
-        while next_page:
-            response = await self.get_json(response['paging']['next'], session, sem)
-            for place in response['data']:
+        pages = 0
+        response = await self.get_json(url, params=params)
+        while response:
+            pages += 1
+            for place in response.get('data', []):
                 id_ = place.get('id')
                 if id_:
                     id_list.append(id_)
-            next_page = 'paging' in response and 'next' in response['paging']
+            next_page = response.get('paging', {}).get('next')
+            if not next_page:
+                return id_list, pages, None, False
+            if max_pages and pages >= max_pages:
+                return id_list, pages, next_page, False
+            response = await self.get_json(next_page)
+        return id_list, pages, None, True
+
+    async def _search_point(self, lat, lon, circle_radius, max_pages=None):
+        return await self._search_pages(
+            self.PLACE_LAT_LON_RADIUS_URL.format(lat, lon,
+                                                 int(round(circle_radius))),
+            params={'access_token': self.token}, max_pages=max_pages)
+
+    async def _get_place_ids_point(self, lat, lon, circle_radius):
+        id_list, _, _, _ = await self._search_point(lat, lon, circle_radius)
         return id_list if id_list else None
 
-    async def _process_saving_places(self, fetch_tasks, save_storage,
-                                     loop, session, sem, block_id):
-        self.logger.debug(f'_process_saving_places - ftasks={len(fetch_tasks)}'
-                          f'block id = {block_id}')
-        places_details_tasks = []
-        places = []
-        for place_ids in tqdm(asyncio.as_completed(fetch_tasks),
-                              total=len(fetch_tasks), file=sys.stdout,
-                              desc=f'[Block {block_id}] Processing points'):
-            for pid in await place_ids:
-                places_details_tasks.append(asyncio.ensure_future(
-                    self.get_json(
-                        self.PLACE_ID_DETAILS_URL.format(pid), session, sem
-                    )))
-        for place_details in tqdm(asyncio.as_completed(places_details_tasks),
-                                  total=len(places_details_tasks),
-                                  file=sys.stdout,
-                                  desc=f'[Block {block_id}] Processing place details'):
-            places.append(await place_details)
-        if save_storage:
-            return asyncio.ensure_future(
-                loop.run_in_executor(
-                    None, self.storage.save_placelist, places)
-            )
+    async def _search_grid_point(self, lat, lon, circle_radius):
+        # Points with missing pages are searched again on resume
+        id_list, _, _, failed = await self._search_point(lat, lon,
+                                                         circle_radius)
+        status = 'failed' if failed else 'done'
+        return self._cell_record(lat, lon, circle_radius, status,
+                                 len(id_list)), id_list
+
+    async def _search_cell(self, cell, max_pages):
+        return (cell, *await self._search_point(*cell.coords,
+                                                cell.circle_radius,
+                                                max_pages=max_pages))
+
+    async def _finish_cell(self, cell, id_list, pages, next_page):
+        # Reads the rest of the pages of a cell which can't be split
+        more_ids, more_pages, _, failed = await self._search_pages(next_page)
+        return cell, id_list + more_ids, pages + more_pages, None, failed
+
+    async def _get_place_ids_adaptive(self, radius, circle_radius, city_coords,
+                                      min_circle_radius=50, saturation=100,
+                                      max_pages=3):
+        # Async generator over the (cell record, id list) pairs of a quadtree
+        # crawl. Starts with coarse cells and splits the ones that came back
+        # saturated, cells finished by a previous run are skipped
+        pending = set()
+        cells = initial_cells(radius, circle_radius, *city_coords)
+        while cells:
+            cell = cells.pop()
+            status = self._fresh_cell_status(*cell.coords, cell.circle_radius)
+            if status == 'split':
+                cells.extend(cell.children())
+            elif status != 'done':
+                pending.add(
+                    asyncio.ensure_future(self._search_cell(cell, max_pages)))
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                cell, id_list, pages, next_page, failed = task.result()
+                saturated = next_page or len(id_list) >= saturation
+                status = 'failed' if failed else 'done'
+                if saturated and cell.circle_radius / 2 >= min_circle_radius:
+                    self.logger.debug(f'Gatherer: Splitting {cell}, '
+                                      f'{len(id_list)} ids in {pages} pages')
+                    status = 'split'
+                    pending.update(
+                        asyncio.ensure_future(
+                            self._search_cell(child, max_pages))
+                        for child in cell.children())
+                elif next_page:
+                    # Nothing left to split, the whole cell is read instead
+                    self.logger.debug(f'Gatherer: {cell} saturated at the '
+                                      f'minimal circle radius, reading '
+                                      f'all its pages')
+                    pending.add(asyncio.ensure_future(self._finish_cell(
+                        cell, id_list, pages, next_page)))
+                    continue
+                yield self._cell_record(*cell.coords, cell.circle_radius,
+                                        status, len(id_list)), id_list
+
+    @staticmethod
+    def _cell_point(lat, lon, circle_radius):
+        return f'{lat:.6f},{lon:.6f},{int(round(circle_radius))}'
+
+    def _cell_record(self, lat, lon, circle_radius, status, result_count):
+        return {
+            'crawl': self._crawl,
+            'point': self._cell_point(lat, lon, circle_radius),
+            'lat': lat,
+            'lon': lon,
+            'circle_radius': circle_radius,
+            'status': status,
+            'result_count': result_count,
+            'updated_time': datetime.datetime.utcnow(),
+        }
+
+    def _fresh_cell_status(self, lat, lon, circle_radius):
+        # Status of the cell in the resumed crawl, None if it wasn't
+        # processed yet, failed or is older than the staleness cutoff
+        cell = self._crawl_state.get(
+            self._cell_point(lat, lon, circle_radius))
+        if not cell or cell['status'] == 'failed':
+            return None
+        if self._stale_before and cell['updated_time'] < self._stale_before:
+            return None
+        return cell['status']
+
+    def _checkpoint(self, records, flush=False):
+        # Cell states are only recorded after their places were saved,
+        # and written to the storage in batches
+        if self._crawl is None:
+            return
+        self._pending_cells.extend(records)
+        if self._pending_cells and (
+                flush or len(self._pending_cells) >= self.checkpoint_size):
+            self.logger.debug(f'Gatherer: Checkpointing '
+                              f'{len(self._pending_cells)} cells')
+            self.storage.save_crawl_cells(self._pending_cells)
+            self._pending_cells = []
+
+    def _get_place_details_tasks(self, place_ids):
+        # The batcher packs the lookups into multi-ID requests,
+        # overlapping circles return the same ids so skip the seen ones
+        tasks = []
+        for pid in place_ids or []:
+            if pid in self.seen_place_ids:
+                continue
+            self.seen_place_ids.add(pid)
+            tasks.append(asyncio.ensure_future(self.place_batcher.get(pid)))
+        return tasks
+
+    def _save_places(self, places, refresh=False):
+        if refresh:
+            self.storage.update_placelist(places)
         else:
-            return places
+            self.storage.save_placelist(places)
 
-    async def _get_places_loc(self, circle_radius, city, radius, loop,
-                              save_storage, max_concurrent, block_size):
-        self.logger.debug('_get_places_loc - starting')
-        sem = asyncio.Semaphore(max_concurrent)
-        city_coords = fbd.tools.get_coords(city)
-        # num_iters = self._num_iters(radius, circle_radius, *city_coords)
-        fetch_tasks = []
-        save_outs = []
-        block_id = 0
-        async with aiohttp.ClientSession() as session:
-            for i, coords in enumerate(
-                    self._generate_points(radius, circle_radius, *city_coords)
-            ):
-                fetch_tasks.append(
-                    asyncio.ensure_future(
-                        self._get_place_ids_point(
-                            *coords, circle_radius, session, sem)
-                    )
-                )
-                if (i + 1) % block_size == 0:
-                    block_id += 1
-                    save_outs.append(
-                        self._process_saving_places(
-                            fetch_tasks, save_storage, loop,
-                            session, sem, block_id)
-                    )
-                    fetch_tasks = []
-            else:
-                if fetch_tasks:
-                    block_id += 1
-                    save_outs.append(
-                        self._process_saving_places(fetch_tasks, save_storage,
-                                                    loop, session, sem, block_id)
-                    )
-                    fetch_tasks = []
-            res = await asyncio.gather(*save_outs)
+    async def _discover_grid(self, points, circle_radius, ids_queue):
+        # Search workers share the lazily filtered points generator
+        async def worker():
+            for coords in points:
+                await ids_queue.put(
+                    await self._search_grid_point(*coords, circle_radius))
+
+        await asyncio.gather(
+            *[worker() for _ in range(self.pipeline_workers)])
+
+    async def _discover_adaptive(self, radius, circle_radius, city_coords,
+                                 ids_queue, **options):
+        async for item in self._get_place_ids_adaptive(
+                radius, circle_radius, city_coords, **options):
+            await ids_queue.put(item)
+
+    async def _fetch_place_details(self, ids_queue, places_queue):
+        # Many workers wait on the place batcher at once, so their lookups
+        # get packed into full multi-ID requests
+        async def worker():
+            item = await ids_queue.get()
+            while item is not None:
+                record, place_ids = item
+                self.metrics.set('fbd_queue_depth', ids_queue.qsize(),
+                                 queue='ids')
+                places = await asyncio.gather(
+                    *self._get_place_details_tasks(place_ids))
+                await places_queue.put(
+                    (record, [place for place in places if place]))
+                item = await ids_queue.get()
+
+        await asyncio.gather(
+            *[worker() for _ in range(self.pipeline_workers)])
+        await places_queue.put(None)
+
+    async def _save_places_sink(self, places_queue, save_storage, refresh,
+                                progress):
+        # Saves the places in batches while the other stages keep fetching,
+        # the cells are checkpointed once their places were saved
+        results = []
+        places = []
+        records = []
+
+        def write():
+            self._save_places(places, refresh)
+            self._checkpoint(records)
+
+        async def flush():
             if save_storage:
-                for task in tqdm(asyncio.as_completed(res),
-                                 total=len(res),
-                                 file=sys.stdout,
-                                 desc='Saving the results'):
-                    await task
+                await self._write(write)
             else:
-                if type(res[0]) == list:
-                    return [item for subarray in res for item in subarray]
-                else:
-                    return res
+                results.extend(places)
+            places.clear()
+            records.clear()
+
+        item = await places_queue.get()
+        while item is not None:
+            record, block = item
+            self.metrics.set('fbd_queue_depth', places_queue.qsize(),
+                             queue='places')
+            records.append(record)
+            places.extend(block)
+            progress.update(1)
+            if (len(places) >= self.save_batch_size or
+                    len(records) >= self.checkpoint_size):
+                await flush()
+            item = await places_queue.get()
+        await flush()
+        await self._write(self._checkpoint, [], True)
+        return results
+
+    async def _get_places_loc(self, circle_radius, city, radius, save_storage,
+                              max_concurrent, refresh=False, strategy='grid',
+                              points=None, adaptive_options=None):
+        # points - explicit grid points to crawl instead of the whole city,
+        # adaptive_options - the keyword arguments of the quadtree crawl
+        self.logger.debug('_get_places_loc - starting')
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        # Bounded queues between the stages keep the memory use independent
+        # of the size of the area
+        ids_queue = asyncio.Queue(maxsize=self.queue_size)
+        places_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        if strategy == 'adaptive':
+            progress = self.progress.task('Processing cells', unit='cell')
+            discovery = self._discover_adaptive(radius, circle_radius,
+                                                fbd.tools.get_coords(city),
+                                                ids_queue,
+                                                **(adaptive_options or {}))
+        else:
+            grid = points if points is not None else HexGrid(
+                radius, circle_radius, *fbd.tools.get_coords(city))
+            # The points done by a resumed crawl aren't part of the total
+            remaining = sum(
+                1 for coords in grid
+                if not self._fresh_cell_status(*coords, circle_radius))
+            todo = (coords for coords in grid
+                    if not self._fresh_cell_status(*coords, circle_radius))
+            progress = self.progress.task('Processing points', remaining,
+                                          'point')
+            discovery = self._discover_grid(todo, circle_radius, ids_queue)
+
+        async def discover():
+            await discovery
+            for _ in range(self.pipeline_workers):
+                await ids_queue.put(None)
+
+        stages = [
+            asyncio.ensure_future(discover()),
+            asyncio.ensure_future(
+                self._fetch_place_details(ids_queue, places_queue)),
+            asyncio.ensure_future(
+                self._save_places_sink(places_queue, save_storage, refresh,
+                                       progress)),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            progress.close()
+        if not save_storage:
+            return stages[-1].result()
 
     def get_places_loc(self, circle_radius, city, radius, save_storage=True,
-                       max_concurrent=3, block_size=3):
+                       max_concurrent=None, refresh=False, strategy='grid',
+                       resume=False, stale_after=None, processes=1,
+                       start_circle_radius=None, min_circle_radius=50,
+                       saturation=100, max_pages=3):
+        '''
+        Finds the places within radius meters of the city and saves their
+        details. The grid strategy searches a hex grid of circle_radius
+        circles. The adaptive one starts with start_circle_radius cells (the
+        whole area by default) and splits the cells returning saturation
+        places or more than max_pages pages, down to min_circle_radius.
+        Without a radius the area covers the city's bounding box.
+        '''
         if not self.storage and save_storage:
             raise Exception('Gatherer: get_places_loc - '
                             'storage wasn\'t defined')
+        if resume and not save_storage:
+            raise Exception('Gatherer: get_places_loc - '
+                            'resuming requires saving to the storage')
+        if strategy not in ('grid', 'adaptive'):
+            raise Exception(f'Gatherer: get_places_loc - '
+                            f'unknown strategy {strategy}')
+        if radius is None:
+            radius = fbd.tools.get_radius(city)
+            self.logger.info(f'Gatherer: Crawling {radius:.0f}m around '
+                             f'{city}')
+        if processes > 1:
+            if strategy != 'grid':
+                raise Exception('Gatherer: get_places_loc - '
+                                'only the grid strategy can be sharded')
+            # Multiprocessing is only loaded for the sharded crawls
+            from fbd import sharding
+            return sharding.get_places_sharded(
+                self, circle_radius, city, radius, processes,
+                save_storage=save_storage, refresh=refresh, resume=resume,
+                stale_after=stale_after)
+        adaptive_options = {
+            'min_circle_radius': min_circle_radius,
+            'saturation': saturation,
+            'max_pages': max_pages,
+        }
+        if strategy == 'adaptive':
+            # The quadtree starts from coarse cells, not the grid's circles
+            circle_radius = start_circle_radius or radius
+        self._prepare_crawl(circle_radius, city, radius, save_storage, refresh,
+                            strategy, resume, stale_after)
         # ASYNC
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        return self._run(
+            self._get_places_loc(circle_radius, city, radius, save_storage,
+                                 max_concurrent, refresh, strategy,
+                                 adaptive_options=adaptive_options)
+        )
+
+    def _prepare_crawl(self, circle_radius, city, radius, save_storage,
+                       refresh, strategy, resume=False, stale_after=None):
+        if self.storage and not refresh:
+            # Places that are already stored don't need their details
+            self.seen_place_ids.update(self.storage.get_all_place_ids())
+        # The crawl state is only kept when saving to the storage, resuming
+        # skips the cells done by previous runs (newer than stale_after)
+        self._crawl = (f'{city}|{radius}|{circle_radius}|{strategy}'
+                       if save_storage else None)
+        self._crawl_state = (self.storage.get_crawl_cells(self._crawl)
+                             if resume else {})
+        self._stale_before = (datetime.datetime.utcnow() - stale_after
+                              if stale_after else None)
+        self._pending_cells = []
+
+    async def _get_events_from_place_id(self, place_id, limit=100,
+                                        since=None, until=None):
+        # Async generator following the paging of a place's events edge,
+        # since/until (unix timestamps) bound the start times of the events
+        params = {
+            'fields': get_fields('event', self.event_fields),
+            'limit': limit,
+            'access_token': self.token,
+        }
+        if since is not None:
+            params['since'] = since
+        if until is not None:
+            params['until'] = until
+        response = await self.get_json(f'{self.GRAPH_URL}{place_id}/events',
+                                       params=params)
+        while response:
+            for event in response.get('data', []):
+                event['place_id'] = place_id
+                yield event
+            next_page = response.get('paging', {}).get('next')
+            response = await self.get_json(next_page) if next_page else None
+
+    async def _stream_per_id(self, ids, edge, desc, unit,
+                             queue_size=1000):
+        # Async generator streaming the items of edge(id) (an async
+        # generator) for all the ids as soon as they arrive. A fixed pool of
+        # workers walks the ids, the actual request concurrency is decided
+        # by the limiter
+        queue = asyncio.Queue(maxsize=queue_size)
+        id_iter = iter(ids)
+        progress = self.progress.task(desc, len(ids), unit)
+
+        async def worker():
+            for id_ in id_iter:
+                async for item in edge(id_):
+                    await queue.put(item)
+                progress.update(1)
+
+        async def run_workers():
+            try:
+                await asyncio.gather(
+                    *[worker() for _ in range(self.limiter.max_concurrency)])
+            finally:
+                await queue.put(None)
+
+        runner = asyncio.ensure_future(run_workers())
         try:
-            res = loop.run_until_complete(
-                self._get_places_loc(circle_radius, city, radius, loop,
-                                     save_storage, max_concurrent, block_size)
-            )
+            item = await queue.get()
+            while item is not None:
+                self.metrics.set('fbd_queue_depth', queue.qsize(), queue=unit)
+                yield item
+                item = await queue.get()
+            await runner
         finally:
-            loop.run_until_complete(loop.shutdown_asyncgens())
-            loop.close()
-
-        return res
-
-    def _get_events_from_place_id_syn(self, place_id):
-        # Getting the pages from graph api
-        req_string = (
-            'https://graph.facebook.com/v2.9/{}?fields=events{{id,name,'
-            'start_time,description,place,type,category,ticket_uri,'
-            'cover.fields(id,source),picture.type(large),attending_count,'
-            'declined_count,maybe_count,noreply_count}}&access_token={}'
-        ).format(place_id, self.token)
-        response = requests.get(req_string).json()
-        event_list = [i for i in response.get('events', {}).get('data', [])]
-        # There are multiple pages in the response and we already went thru 1
-        while response.get('events', {}).get('paging', {}).get('next', None):
-            response = requests.get(response['events']['paging']['next']).json()
-            for event in response.get('data', []):
-                event_list.append(event)
-        return [place_id, event_list]
+            runner.cancel()
+            progress.close()
 
-    async def _get_events_from_places(self, loop, place_ids):
-        tasks = [
-            loop.run_in_executor(None, self._get_events_from_place_id_syn,
-                                 place_id) for place_id in place_ids
-        ]
-        events = []
-        for pid_elist in tqdm(
-                asyncio.as_completed(tasks), total=len(place_ids),
-                desc='Getting events per place', unit='place', file=sys.stdout):
-            pelist = await pid_elist
-            for event in tqdm(pelist[1], desc='Processing place events',
-                              unit='events', file=sys.stdout):
-                event['place_id'] = pelist[0]
-                events.append(event)
-        return events
-
-    def get_events_from_places(self, save_storage=True):
+    def _get_events_from_places(self, place_ids, queue_size=1000,
+                                since=None, until=None, limit=100):
+        # since maps the place ids to the start of their time window
+        since = since or {}
+        return self._stream_per_id(
+            place_ids,
+            lambda place_id: self._get_events_from_place_id(
+                place_id, limit, since.get(place_id), until),
+            'Getting events per place', 'place', queue_size)
+
+    def _event_windows(self, overlap):
+        # Upcoming events may still change, so a place's window starts at
+        # its newest known event or now, whichever comes first. The overlap
+        # absorbs the timezones dropped by the storage
+        now = datetime.datetime.utcnow()
+        return {
+            place_id: calendar.timegm((min(newest, now) - overlap).timetuple())
+            for place_id, newest
+            in self.storage.get_event_watermarks().items() if newest
+        }
+
+    def get_events_from_places(self, save_storage=True, max_concurrent=None,
+                               incremental=False, until=None, limit=100,
+                               overlap=datetime.timedelta(days=1)):
+        '''
+        Downloads the events of the stored places. The incremental mode only
+        asks for the events starting after the newest known one of each
+        place (or now, so the upcoming ones get refreshed), until (a
+        datetime) caps the start times. The events are upserted in batches,
+        they are returned if save_storage is False.
+        '''
         if not self.storage:
             raise Exception('Gatherer: get_events_from_places - '
                             'storage wasn\'t defined')
         self.logger.debug('Gatherer: get_events_from_places request')
         place_ids = self.storage.get_all_place_ids()
+        since = self._event_windows(overlap) if incremental else None
+        if until is not None:
+            until = calendar.timegm(until.timetuple())
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
 
-        loop = asyncio.get_event_loop()
-        events = loop.run_until_complete(
-            asyncio.ensure_future(
-                self._get_events_from_places(loop, place_ids)
-            )
-        )
-        loop.close()
+        async def collect():
+            events = []
+            batch = []
+            async for event in self._get_events_from_places(
+                    place_ids, since=since, until=until, limit=limit):
+                if save_storage:
+                    batch.append(event)
+                    if len(batch) >= self.save_batch_size:
+                        await self._write(self.storage.upsert_eventlist,
+                                          batch)
+                        batch.clear()
+                else:
+                    events.append(event)
+            if batch:
+                await self._write(self.storage.upsert_eventlist, batch)
+            return events
 
-        if save_storage:
-            for e in tqdm(events, desc='Saving events', leave=False,
-                          file=sys.stdout, unit='event'):
-                self.storage.save_event(e)
-        return events
+        events = self._run(collect())
+        if not save_storage:
+            return events
 
-    async def _update_places(self, place_ids, max_concurrent=3):
+    async def _update_places(self, place_ids, max_concurrent=None):
         places = []
-        sem = asyncio.Semaphore(max_concurrent)
-        # TODO: make those urls into classwide constants
-        url = ('https://graph.facebook.com/v2.9/{0}?fields=id,name,'
-               'place_type,place_topics,cover.fields(id,source),'
-               'picture.type(large),location&access_token={1}')
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                Gatherer.get_json(url.format(pid, self.token), session, sem)
-                for pid in place_ids
-            ]
-            for place in tqdm(
-                    asyncio.as_completed(tasks), total=len(place_ids),
-                    desc='Updating places', unit='place', file=sys.stdout):
-                places.append(await place)
-            return places
-
-    def update_places(self, max_concurrent=3):
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        tasks = [
+            self.get_json_ids(batch, get_fields('place', self.place_fields))
+            for batch in chunks(place_ids)
+        ]
+        with self.progress.task('Updating places', len(tasks),
+                                'batch') as progress:
+            for batch in asyncio.as_completed(tasks):
+                places.extend(place for place in (await batch).values()
+                              if place)
+                progress.update()
+        return places
+
+    def update_places(self, max_concurrent=None, max_age=None, budget=None):
+        '''
+        Downloads the details of the stored places again. With max_age (a
+        timedelta) only the places fetched longer ago are refreshed and
+        budget caps their number, the oldest ones go first. Places that
+        could not be downloaded are marked as fetched all the same.
+        '''
         if not self.storage:
             raise Exception('Gatherer: update_places - '
                             'storage wasn\'t defined')
-        place_ids = self.storage.get_all_place_ids()
-        loop = asyncio.get_event_loop()
-        places = loop.run_until_complete(
-            asyncio.ensure_future(
-                self._update_places(place_ids, max_concurrent)))
-        loop.close()
+        if max_age is None and budget is None:
+            place_ids = self.storage.get_all_place_ids()
+        else:
+            place_ids = self.storage.get_stale_place_ids(max_age, budget)
+        self.logger.info(f'Gatherer: Updating {len(place_ids)} places')
+        places = self._run(self._update_places(place_ids, max_concurrent))
+
+        with self.progress.task('Saving places', len(places),
+                                'place') as progress:
+            for batch in chunks(places, self.save_batch_size):
+                self.storage.update_placelist(batch)
+                progress.update(len(batch))
+        # The ids that came back missing (deleted places, dead letters) are
+        # tried again after max_age instead of taking the next budget
+        missing = set(place_ids) - {place['id'] for place in places}
+        if missing:
+            self.logger.info(f'Gatherer: {len(missing)} places could not '
+                             f'be updated')
+            self.storage.touch_places(missing)
+
+    async def _get_posts_from_page(self, page_id, limit=100,
+                                   max_posts=None):
+        # Async generator following the paging of a page's posts edge,
+        # limit is the page size and max_posts caps the number of posts
+        params = {
+            'fields': get_fields('post', self.post_fields),
+            'limit': limit,
+            'access_token': self.token,
+        }
+        response = await self.get_json(f'{self.GRAPH_URL}{page_id}/posts',
+                                       params=params)
+        count = 0
+        while response:
+            for post in response.get('data', []):
+                if max_posts is not None and count >= max_posts:
+                    return
+                count += 1
+                yield Gatherer._response_to_post(post, page_id)
+            next_page = response.get('paging', {}).get('next')
+            response = await self.get_json(next_page) if next_page else None
+
+    async def _get_pages(self, page_ids, get_posts=True, save_storage=True,
+                         limit=100, max_posts=None):
+        pages = await IdBatcher(
+            lambda ids: self.get_json_ids(
+                ids, get_fields('page', self.page_fields)),
+            logger=self.logger).get_many(page_ids)
+        pages = [page for page in pages.values() if page]
+        if save_storage:
+            for batch in chunks(pages, self.save_batch_size):
+                self.storage.upsert_pagelist(batch)
+        posts = []
+        if not get_posts:
+            return pages, posts
+        batch = []
+        async for post in self._stream_per_id(
+                [page['id'] for page in pages],
+                lambda page_id: self._get_posts_from_page(
+                    page_id, limit, max_posts),
+                'Getting posts per page', 'page', self.queue_size):
+            if save_storage:
+                batch.append(post)
+                if len(batch) >= self.save_batch_size:
+                    await self._write(self.storage.upsert_postlist, batch)
+                    batch.clear()
+            else:
+                posts.append(post)
+        if batch:
+            await self._write(self.storage.upsert_postlist, batch)
+        return pages, posts
 
-        for p in tqdm(places, desc='Saving places', leave=False,
-                      file=sys.stdout, unit='place'):
-            self.storage.update_place(p)
+    def get_pages(self, page_ids, get_posts=True, save_storage=True,
+                  max_concurrent=None, limit=100, max_posts=None):
+        '''
+        Downloads the details of the pages in multi-ID batches and then the
+        posts of all the pages concurrently, limit posts per request and at
+        most max_posts per page. Everything is upserted in batches, the
+        pages and posts are returned if save_storage is False.
+        '''
+        if not self.storage and save_storage:
+            raise Exception('Gatherer: get_pages - '
+                            'storage wasn\'t defined')
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        pages, posts = self._run(self._get_pages(
+            page_ids, get_posts, save_storage, limit, max_posts))
+        if not save_storage:
+            return pages, posts
 
     def get_page(self, page_id, get_posts=True):
-        # id,name,about,category,fan_count
-        request_str = ('https://graph.facebook.com/v2.9/{}'
-                       '?fields=id,name,about,category,fan_count'
-                       '&access_token={}')
-        page = requests.get(request_str.format(page_id, self.token)).json()
-        self.storage.save_page(page)
-        if get_posts:
-            for post in self.get_posts(page['id']):
-                self.storage.save_post(post)
+        self.get_pages([page_id], get_posts)
 
     def get_page_id(self, url):
-        url = Gatherer._clean_url(url)
-        request_str = 'https://graph.facebook.com/v2.9/?id={}&access_token={}'
-        response = requests.get(request_str.format(url, self.token)).json()
+        response = self._run(self.get_json(self.GRAPH_URL, params={
+            'id': Gatherer._clean_url(url),
+            'access_token': self.token,
+        }))
         return response['id']
 
     def get_posts(self, page_id, limit=100):
-        # nytimes?fields=posts{link,message,id,created_time}
-        request_str = (
-            'https://graph.facebook.com/v2.9/{}'
-            '?fields=posts{{'
-            'link, message, id, created_time,'
-            'reactions.type(LIKE).limit(0).summary(total_count).as(like),'
-            'reactions.type(LOVE).limit(0).summary(total_count).as(love),'
-            'reactions.type(HAHA).limit(0).summary(total_count).as(haha),'
-            'reactions.type(WOW).limit(0).summary(total_count).as(wow),'
-            'reactions.type(SAD).limit(0).summary(total_count).as(sad),'
-            'reactions.type(ANGRY).limit(0).summary(total_count).as(angry),'
-            'reactions.type(THANKFUL).limit(0).summary(total_count)'
-            '.as(thankful)}}&access_token={}')
-        # print(request_str.format(page_id, self.token))
-        response = requests.get(
-            request_str.format(page_id, self.token)).json()['posts']
-        posts = []
-        i = 0
-        while 'paging' in response and 'next' in response['paging']:
-            response = requests.get(response['paging']['next']).json()
-            for post in response['data']:
-                posts.append(Gatherer._response_to_post(post, page_id))
-                i += 1
-            if i >= limit:
-                break
-        return posts
+        async def collect():
+            return [post async for post in self._get_posts_from_page(
+                page_id, min(limit, 100), limit)]
 
-    def get_post_reactions(self, post_id):
-        request_str = (
-            'https://graph.facebook.com/v2.9/{}?fields='
-            'reactions.type(LIKE).limit(0).summary(total_count).as(like),'
-            'reactions.type(LOVE).limit(0).summary(total_count).as(love),'
-            'reactions.type(HAHA).limit(0).summary(total_count).as(haha),'
-            'reactions.type(WOW).limit(0).summary(total_count).as(wow),'
-            'reactions.type(SAD).limit(0).summary(total_count).as(sad),'
-            'reactions.type(ANGRY).limit(0).summary(total_count).as(angry),'
-            'reactions.type(THANKFUL).limit(0).summary(total_count)'
-            '.as(thankful)&access_token={}')
-        response = requests.get(request_str.format(post_id, self.token)).json()
-        del response['id']
+        return self._run(collect())
+
+    @staticmethod
+    def _response_to_reactions(post):
         return {
-            item: response[item]['summary']['total_count']
-            for item in response
+            reaction: (post.get(reaction, {}).get('summary', {})
+                       .get('total_count'))
+            for reaction in REACTION_TYPES
         }
 
+    async def _get_reactions(self, post_ids):
+        # Multi-ID requests of 50 posts each, all in flight under the limiter
+        reactions = {}
+        tasks = [self.get_json_ids(batch, REACTION_FIELDS)
+                 for batch in chunks(post_ids)]
+        with self.progress.task('Refreshing reactions', len(tasks),
+                                'batch') as progress:
+            for batch in asyncio.as_completed(tasks):
+                for post_id, post in (await batch).items():
+                    if post:
+                        reactions[post_id] = Gatherer._response_to_reactions(
+                            post)
+                progress.update()
+        return reactions
+
+    def refresh_reactions(self, post_ids=None, save_storage=True,
+                          max_concurrent=None):
+        '''
+        Downloads the reaction counts of many posts (by default all the
+        stored ones) and writes them back in bulk. Returns a dict mapping
+        the post ids to their counts if save_storage is False.
+        '''
+        if not self.storage and (save_storage or post_ids is None):
+            raise Exception('Gatherer: refresh_reactions - '
+                            'storage wasn\'t defined')
+        if post_ids is None:
+            post_ids = self.storage.get_all_post_ids()
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        reactions = self._run(self._get_reactions(post_ids))
+        if not save_storage:
+            return reactions
+        for batch in chunks(reactions.items(), self.save_batch_size):
+            self.storage.update_reactions(dict(batch))
+
+    def get_post_reactions(self, post_id):
+        return self._run(self._get_reactions([post_id])).get(post_id)
+
+    @staticmethod
+    def _dead_letter_kind(entry):
+        # What a failed request was downloading, from its path and fields
+        url, params = entry['url'], entry['params']
+        path = urlsplit(url).path
+        for edge in ('search', 'events', 'posts'):
+            if path.endswith(f'/{edge}'):
+                return edge
+        if 'ids' not in params:
+            return None
+        fields = params.get('fields')
+        if fields == REACTION_FIELDS:
+            return 'reactions'
+        for kind in ('place', 'page'):
+            if fields in {get_fields(kind, profile)
+                          for profile in PROFILE_NAMES}:
+                return kind
+        return None
+
+    async def _get_dead_letter(self, entry):
+        # The items of the failed request and of the pages after it
+        items = []
+        response = await self.get_json(
+            entry['url'], params=dict(entry['params'],
+                                      access_token=self.token))
+        while response:
+            items.extend(response.get('data', []))
+            next_page = response.get('paging', {}).get('next')
+            response = await self.get_json(next_page) if next_page else None
+        return items
+
+    async def _retry_dead_letter(self, entry, results):
+        kind = self._dead_letter_kind(entry)
+        params = entry['params']
+        if kind == 'search':
+            ids = [place['id'] for place in await self._get_dead_letter(entry)]
+            places = await self.place_batcher.get_many(ids)
+            results['places'].extend(place for place in places.values()
+                                     if place)
+        elif kind in ('events', 'posts'):
+            object_id = urlsplit(entry['url']).path.split('/')[-2]
+            for item in await self._get_dead_letter(entry):
+                if kind == 'events':
+                    item['place_id'] = object_id
+                    results['events'].append(item)
+                else:
+                    results['posts'].append(
+                        Gatherer._response_to_post(item, object_id))
+        elif kind in ('place', 'page', 'reactions'):
+            objects = await self.get_json_ids(params['ids'].split(','),
+                                              params['fields'])
+            for object_id, obj in objects.items():
+                if not obj:
+                    continue
+                if kind == 'reactions':
+                    results['reactions'][object_id] = (
+                        Gatherer._response_to_reactions(obj))
+                else:
+                    results[f'{kind}s'].append(obj)
+        else:
+            self.logger.warning(f'Gatherer: Can\'t retry {entry["url"]}, '
+                                f'keeping it in the dead letters')
+            self.dead_letters.entries.append(entry)
+
+    def retry_dead_letters(self, path=None, save_storage=True,
+                           max_concurrent=None):
+        '''
+        Sends the dead letters (loaded from path if given) again and saves
+        their places, events, pages, posts and reactions like the regular
+        downloads would. The requests that keep failing end up in the dead
+        letters again. Returns the downloaded objects by kind if
+        save_storage is False.
+        '''
+        if not self.storage and save_storage:
+            raise Exception('Gatherer: retry_dead_letters - '
+                            'storage wasn\'t defined')
+        if path:
+            self.dead_letters.load(path)
+        entries = self.dead_letters.pop_all()
+        self.logger.info(f'Gatherer: Retrying {len(entries)} failed requests')
+        if max_concurrent:
+            self.limiter.set_concurrency(max_concurrent)
+        results = {'places': [], 'events': [], 'pages': [], 'posts': [],
+                   'reactions': {}}
+
+        async def retry():
+            with self.progress.task('Retrying dead letters', len(entries),
+                                    'request') as progress:
+                for task in asyncio.as_completed([
+                        self._retry_dead_letter(entry, results)
+                        for entry in entries]):
+                    await task
+                    progress.update()
+
+        self._run(retry())
+        if not save_storage:
+            return results
+        for kind, save in (('places', self.storage.update_placelist),
+                           ('events', self.storage.upsert_eventlist),
+                           ('pages', self.storage.upsert_pagelist),
+                           ('posts', self.storage.upsert_postlist)):
+            for batch in chunks(results[kind], self.save_batch_size):
+                save(batch)
+        for batch in chunks(results['reactions'].items(),
+                            self.save_batch_size):
+            self.storage.update_reactions(dict(batch))
+
 
 if __name__ == '__main__':
+    from fbd.storage import Storage
+
     config = {
         'storage_url': 'sqlite:///fbd/db/fb.sqlite',
         'verbose': False,
@@ -483,15 +1186,17 @@ if __name__ == '__main__':
     from pprint import pprint
     results = []
     for max_concurrent in [1, 3, 5, 10, 500]:
-        for block_size in [1, 3, 10, 20]:
+        for queue_size in [1, 3, 10, 20]:
+            gatherer.queue_size = queue_size
             start = time.time()
             gatherer.get_places_loc(
-                params['circle_radius'], 'Wroclaw', params['radius'], block_size=block_size, max_concurrent=max_concurrent)
+                params['circle_radius'], 'Wroclaw', params['radius'], max_concurrent=max_concurrent)
             end = time.time()
             results.append({'time': end - start,
-                            'block_size': block_size,
+                            'queue_size': queue_size,
                             'max_concurrent': max_concurrent})
     pprint(results)
+    gatherer.close()
     # gatherer.get_events_from_places()
     # gatherer.update_places()
     # print(gatherer.get_posts(gatherer.get_page_id('https://web.facebook.com/cnn/')))
@@ -0,0 +1,53 @@
+# STL imports
+import math
+
+# Package imports
+import numpy as np
+
+import fbd.tools
+
+
+class HexGrid:
+    '''
+    Centers of the search circles covering a circular area.
+
+    The circles are hex-packed (the densest full covering of the plane),
+    laid out in meters on a plane tangent to the center and converted to
+    degrees with latitude dependent scales. Points whose circle can't
+    reach the search area are clipped.
+    '''
+
+    def __init__(self, radius, circle_radius, center_lat, center_lng):
+        self.radius = float(radius)
+        self.circle_radius = float(circle_radius)
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        self.points = self._build()
+
+    def _build(self):
+        row_step = 1.5 * self.circle_radius
+        col_step = math.sqrt(3) * self.circle_radius
+        reach = self.radius + self.circle_radius
+        n_rows = int(math.ceil(reach / row_step))
+        n_cols = int(math.ceil(reach / col_step)) + 1
+
+        # From top to bottom, every other row shifted by half a step
+        rows = np.arange(n_rows, -n_rows - 1, -1)
+        cols = np.arange(-n_cols, n_cols + 1)
+        y = np.repeat(rows * row_step, len(cols)).reshape(len(rows), -1)
+        x = (cols[np.newaxis, :] * col_step +
+             (rows[:, np.newaxis] % 2) * col_step / 2)
+        inside = np.hypot(x, y) <= reach
+
+        lat = self.center_lat + y / fbd.tools.met_per_deg_lat(self.center_lat)
+        lon_scale = np.array([fbd.tools.met_per_deg_lon(row_lat)
+                              for row_lat in lat[:, 0]])
+        lng = self.center_lng + x / lon_scale[:, np.newaxis]
+        return np.column_stack((lat[inside], lng[inside]))
+
+    def __len__(self):
+        return len(self.points)
+
+    def __iter__(self):
+        for lat, lng in self.points:
+            yield float(lat), float(lng)
@@ -0,0 +1,217 @@
+# STL imports
+import asyncio
+import collections
+import json
+import logging
+import time
+
+# Graph API error codes that mean we're being throttled
+# 4 - application, 17 - user, 32 - page, 613 - custom rate limit
+THROTTLE_CODES = {4, 17, 32, 613}
+USAGE_HEADERS = ('X-App-Usage', 'X-Business-Use-Case-Usage')
+
+
+def parse_usage(headers):
+    '''
+    Returns the highest usage percentage reported by the Graph API usage
+    headers and the number of seconds the API asked us to wait (if any)
+    '''
+    usage = None
+    wait = 0
+    for header in USAGE_HEADERS:
+        raw = headers.get(header)
+        if not raw:
+            continue
+        try:
+            parsed = json.loads(raw)
+        except ValueError:
+            logging.debug(f'parse_usage: Malformed {header} header: {raw}')
+            continue
+        # X-App-Usage is a single dict, X-Business-Use-Case-Usage maps
+        # business ids to lists of dicts
+        if isinstance(parsed, dict) and 'call_count' in parsed:
+            entries = [parsed]
+        else:
+            entries = [entry for value in parsed.values()
+                       for entry in (value if isinstance(value, list)
+                                     else [value])]
+        for entry in entries:
+            for key in ('call_count', 'total_time', 'total_cputime'):
+                if key in entry:
+                    usage = max(usage or 0, float(entry[key]))
+            # Reported in minutes
+            wait = max(wait,
+                       60 * float(entry.get('estimated_time_to_regain_access',
+                                            0)))
+    return usage, wait
+
+
+class RateLimiter:
+    '''
+    Token bucket (requests per second) combined with an AIMD concurrency
+    window. Used as an async context manager around every request and fed
+    the response headers / Graph errors through feedback().
+
+    Like TCP, the rate starts at start_rate and doubles every second until
+    the first back-off, it then grows by increase per second. The limits
+    are decreased at most once per decrease_window seconds, the
+    requests in flight report the same overload. Throttling pauses the
+    requests for the time the API asks for, or for throttle_pause seconds
+    doubling on repeated throttles up to max_throttle_pause.
+    '''
+
+    def __init__(self, rate=50.0, burst=None, concurrency=3,
+                 min_concurrency=1, max_concurrency=100, usage_target=75.0,
+                 usage_cap=90.0, increase=1.0, decrease=0.5,
+                 throttle_pause=1.0, max_throttle_pause=60.0,
+                 decrease_window=1.0, start_rate=10.0, logger=None):
+        self.logger = logger if logger else logging
+        self.max_rate = float(rate)
+        self.rate = min(self.max_rate, float(start_rate))
+        self.slow_start = True
+        self.burst = float(burst) if burst else max(1.0, self.max_rate)
+        self.tokens = self._bucket_size()
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(min(max(concurrency, min_concurrency),
+                                     max_concurrency))
+        self.usage_target = usage_target
+        self.usage_cap = usage_cap
+        self.increase = increase
+        self.decrease = decrease
+        self.throttle_pause = throttle_pause
+        self.max_throttle_pause = max_throttle_pause
+        self.decrease_window = decrease_window
+        self._next_pause = throttle_pause
+        self._decrease_after = 0.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_refill = time.monotonic()
+        # Requests waiting for a slot in the window, served in order
+        self._waiters = collections.deque()
+
+    def set_concurrency(self, concurrency):
+        self.concurrency = float(min(max(concurrency, self.min_concurrency),
+                                     self.max_concurrency))
+        self._wake()
+
+    def _wake(self):
+        # Hands the free slots over to the longest waiting requests
+        while self._waiters and self.in_flight < int(self.concurrency):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _bucket_size(self):
+        # At most a second worth of tokens at the current rate
+        return min(self.burst, max(1.0, self.rate))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self._bucket_size(),
+                          self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def _pause(self):
+        pause = self.paused_until - time.monotonic()
+        while pause > 0:
+            await asyncio.sleep(pause)
+            pause = self.paused_until - time.monotonic()
+
+    async def _take_token(self):
+        # The tokens are reserved in order, a negative balance is the
+        # queue of requests waiting for the bucket to refill
+        await self._pause()
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+            await self._pause()
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < int(self.concurrency):
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # Cancelled right after getting the slot
+                    self._release()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+        try:
+            await self._take_token()
+        except BaseException:
+            self._release()
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    async def release(self):
+        self._release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.release()
+
+    def _back_off(self, pause=0.0):
+        now = time.monotonic()
+        if now < self._decrease_after:
+            return
+        self._decrease_after = now + self.decrease_window
+        self.slow_start = False
+        self.concurrency = max(self.min_concurrency,
+                               self.concurrency * self.decrease)
+        self.rate = max(1.0, self.rate * self.decrease)
+        if pause:
+            self.paused_until = max(self.paused_until, now + pause)
+            # No burst of saved up tokens once the pause is over
+            self.tokens = min(self.tokens, 0.0)
+            self._last_refill = self.paused_until
+        self.logger.debug(f'RateLimiter: Backing off, concurrency='
+                          f'{self.concurrency:.1f}, rate={self.rate:.1f}/s, '
+                          f'pause={pause:.0f}s')
+
+    def _ramp_up(self):
+        self._next_pause = self.throttle_pause
+        self.concurrency = min(self.max_concurrency,
+                               self.concurrency + self.increase / self.concurrency)
+        self._wake()
+        # About rate responses arrive per second, so the rate grows by
+        # increase per second like the window grows by increase per round
+        # trip. In the slow start it grows by its own size instead
+        step = self.increase if self.slow_start else self.increase / self.rate
+        self.rate = min(self.max_rate, self.rate + step)
+
+    def feedback(self, headers=None, error=None):
+        '''
+        Adjusts the limits based on the usage headers of a response and
+        the Graph API error object (if the response contained one)
+        '''
+        usage, wait = parse_usage(headers) if headers else (None, 0)
+        if error and error.get('code') in THROTTLE_CODES:
+            self.logger.info(f'RateLimiter: Throttled by the API, '
+                             f'code={error.get("code")}')
+            if time.monotonic() >= self._decrease_after:
+                pause = wait if wait else self._next_pause
+                if not wait:
+                    self._next_pause = min(self.max_throttle_pause,
+                                           2 * self._next_pause)
+                self._back_off(pause)
+            return
+        if usage is None:
+            self._ramp_up()
+        elif usage >= self.usage_cap or wait:
+            self._back_off(wait)
+        elif usage < self.usage_target:
+            self._ramp_up()
@@ -0,0 +1,203 @@
+# STL imports
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last slot counts the observations above the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class Metrics:
+    '''
+    Registry of labelled counters, gauges and histograms, exported as a
+    JSON snapshot or in the Prometheus text format. Every process has a
+    default one, REGISTRY, used by the Gatherer and the Storage.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        def entries(metrics, value):
+            return [{'name': name, 'labels': dict(labels),
+                     'value': value(metric)}
+                    for (name, labels), metric in sorted(metrics.items())]
+
+        with self._lock:
+            return {
+                'time': time.time(),
+                'counters': entries(self.counters, lambda value: value),
+                'gauges': entries(self.gauges, lambda value: value),
+                'histograms': entries(self.histograms,
+                                      lambda histogram: histogram.to_dict()),
+            }
+
+    def merge(self, snapshot):
+        # Adds the counters and histograms of another registry's snapshot,
+        # e.g. from a shard worker process. Its gauges replace ours
+        with self._lock:
+            for entry in snapshot['counters']:
+                key = self._key(entry['name'], entry['labels'])
+                self.counters[key] = self.counters.get(key, 0) + entry['value']
+            for entry in snapshot['gauges']:
+                self.gauges[self._key(entry['name'],
+                                      entry['labels'])] = entry['value']
+            for entry in snapshot['histograms']:
+                key = self._key(entry['name'], entry['labels'])
+                other = entry['value']
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(
+                        other['buckets'])
+                histogram.counts = [mine + theirs for mine, theirs
+                                    in zip(histogram.counts, other['counts'])]
+                histogram.count += other['count']
+                histogram.sum += other['sum']
+
+    def to_prometheus(self):
+        def labels_str(labels, **extra):
+            labels = dict(labels, **extra)
+            if not labels:
+                return ''
+            return '{' + ','.join(
+                '{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                for key, value in sorted(labels.items())) + '}'
+
+        snapshot = self.snapshot()
+        lines = []
+        for kind, metric_type in (('counters', 'counter'),
+                                  ('gauges', 'gauge')):
+            declared = set()
+            for entry in snapshot[kind]:
+                if entry['name'] not in declared:
+                    lines.append(f'# TYPE {entry["name"]} {metric_type}')
+                    declared.add(entry['name'])
+                lines.append(f'{entry["name"]}{labels_str(entry["labels"])} '
+                             f'{entry["value"]}')
+        declared = set()
+        for entry in snapshot['histograms']:
+            name, histogram = entry['name'], entry['value']
+            if name not in declared:
+                lines.append(f'# TYPE {name} histogram')
+                declared.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'] + ['+Inf'],
+                                    histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{labels_str(entry["labels"], le=bound)} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{labels_str(entry["labels"])} '
+                         f'{histogram["sum"]}')
+            lines.append(f'{name}_count{labels_str(entry["labels"])} '
+                         f'{histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''
+        Saves the metrics to path, in the Prometheus text format unless
+        the path ends with .json
+        '''
+        if path.endswith('.json'):
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.to_prometheus()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+class PeriodicWriter:
+    '''
+    Writes the metrics to path every interval seconds from a daemon
+    thread, and once more when stopped
+    '''
+
+    def __init__(self, metrics, path, interval=60.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.metrics.write(self.path)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.metrics.write(self.path)
+
+
+REGISTRY = Metrics()
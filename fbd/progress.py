@@ -0,0 +1,126 @@
+# STL imports
+import logging
+import sys
+import time
+
+
+class Task:
+    '''
+    Progress of one phase. update() only counts, the output is refreshed
+    at most every interval seconds and once more on close().
+    '''
+
+    def __init__(self, reporter, desc, total=None, unit='it'):
+        self.reporter = reporter
+        self.desc = desc
+        self.total = total
+        self.unit = unit
+        self.n = 0
+        self.start = time.monotonic()
+        self._last_refresh = self.start
+        self.closed = False
+
+    def update(self, n=1):
+        self.n += n
+        now = time.monotonic()
+        if now - self._last_refresh >= self.reporter.interval:
+            self._last_refresh = now
+            self.refresh()
+
+    def set_total(self, total):
+        self.total = total
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    @property
+    def rate(self):
+        return self.n / self.elapsed if self.elapsed else 0.0
+
+    def refresh(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.refresh()
+        self.reporter._finished(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BarTask(Task):
+
+    def __init__(self, reporter, desc, total=None, unit='it'):
+        super().__init__(reporter, desc, total, unit)
+        # tqdm is only needed for interactive runs
+        from tqdm import tqdm
+        self.bar = tqdm(desc=desc, total=total, unit=unit, file=sys.stdout,
+                        mininterval=reporter.interval)
+
+    def set_total(self, total):
+        super().set_total(total)
+        self.bar.total = total
+
+    def refresh(self):
+        self.bar.update(self.n - self.bar.n)
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self.bar.close()
+
+
+class LogTask(Task):
+
+    def refresh(self):
+        # One key=value line, easy to grep and to parse
+        total = self.total if self.total is not None else '-'
+        self.reporter.logger.info(
+            f'progress phase="{self.desc}" done={self.n} total={total} '
+            f'unit={self.unit} rate={self.rate:.1f}/s '
+            f'elapsed={self.elapsed:.1f}s')
+
+
+class ProgressReporter:
+    '''
+    Creates the progress tasks of the phases of a run: tqdm bars ('bar'),
+    rate-limited structured log lines ('log') or nothing ('quiet'). 'auto'
+    picks the bars on a terminal and the log lines otherwise, e.g. under
+    cron. The finished tasks are aggregated per phase in totals.
+    '''
+
+    MODES = ('auto', 'bar', 'log', 'quiet')
+
+    def __init__(self, mode='auto', interval=None, logger=None):
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown progress mode: {mode}')
+        if mode == 'auto':
+            mode = 'bar' if sys.stdout.isatty() else 'log'
+        self.mode = mode
+        # Bars can refresh often, log lines shouldn't flood the logs
+        self.interval = (interval if interval is not None
+                         else 0.5 if mode == 'bar' else 30.0)
+        self.logger = logger if logger else logging
+        self.totals = {}
+
+    def task(self, desc, total=None, unit='it'):
+        cls = {'bar': BarTask, 'log': LogTask, 'quiet': Task}[self.mode]
+        return cls(self, desc, total, unit)
+
+    def _finished(self, task):
+        phase = self.totals.setdefault(
+            task.desc, {'done': 0, 'unit': task.unit, 'seconds': 0.0})
+        phase['done'] += task.n
+        phase['seconds'] += task.elapsed
+
+    def summary(self):
+        return '\n'.join(
+            f'{desc}: {phase["done"]} {phase["unit"]} in '
+            f'{phase["seconds"]:.1f}s' for desc, phase in self.totals.items())
@@ -0,0 +1,58 @@
+# STL imports
+import math
+
+import fbd.tools
+
+
+class Cell:
+    '''
+    Square search cell, x/y are the offsets (in meters) of its center from
+    the center of the whole search area. A cell is queried with the
+    smallest circle containing it.
+    '''
+
+    def __init__(self, x, y, half_size, center_lat, center_lng, depth=0):
+        self.x = x
+        self.y = y
+        self.half_size = half_size
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        self.depth = depth
+
+    @property
+    def circle_radius(self):
+        return self.half_size * math.sqrt(2)
+
+    @property
+    def coords(self):
+        lat = self.center_lat + fbd.tools.lat_from_met(self.y,
+                                                       self.center_lat)
+        lng = self.center_lng + fbd.tools.lon_from_met(self.x, lat)
+        return lat, lng
+
+    def children(self):
+        half = self.half_size / 2
+        return [
+            Cell(self.x + dx * half, self.y + dy * half, half,
+                 self.center_lat, self.center_lng, self.depth + 1)
+            for dy in (1, -1) for dx in (-1, 1)
+        ]
+
+    def __repr__(self):
+        return '<Cell ({:.0f}, {:.0f}) r={:.0f} depth={}>'.format(
+            self.x, self.y, self.circle_radius, self.depth)
+
+
+def initial_cells(radius, circle_radius, center_lat, center_lng):
+    # Square tiling of the search area with cells fitting into circle_radius,
+    # skipping the ones whose circle can't reach the search area
+    half_size = circle_radius / math.sqrt(2)
+    n = int(math.ceil(radius / (2 * half_size)))
+    cells = []
+    for row in range(n - 1, -n - 1, -1):
+        for col in range(-n, n):
+            x = (2 * col + 1) * half_size
+            y = (2 * row + 1) * half_size
+            if math.hypot(x, y) <= radius + circle_radius:
+                cells.append(Cell(x, y, half_size, center_lat, center_lng))
+    return cells
@@ -0,0 +1,78 @@
+# STL imports
+import json
+import logging
+import random
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Graph API error codes worth retrying: unknown/service errors, throttling
+# and temporary unavailability
+RETRIABLE_CODES = {1, 2, 4, 17, 32, 341, 368, 613}
+
+
+class GraphError(Exception):
+
+    def __init__(self, error_dict):
+        self.code = error_dict.get('code')
+        self.subcode = error_dict.get('error_subcode')
+        self.type = error_dict.get('type')
+        self.transient = bool(error_dict.get('is_transient'))
+        super().__init__(
+            f'Graph API error {self.code}: {error_dict.get("message")}')
+
+    @property
+    def retriable(self):
+        return self.transient or self.code in RETRIABLE_CODES
+
+
+class ServerError(Exception):
+    pass
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    # Capped exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def strip_token(url):
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query)
+             if key != 'access_token']
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class DeadLetters:
+    '''
+    Requests that failed even after retrying. Access tokens are stripped,
+    so the list can be dumped to a file and retried with a fresh token.
+    '''
+
+    def __init__(self):
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def add(self, url, params=None, error=None):
+        self.entries.append({
+            'url': strip_token(url),
+            'params': {key: value for key, value in (params or {}).items()
+                       if key != 'access_token'},
+            'error': str(error),
+        })
+
+    def pop_all(self):
+        entries, self.entries = self.entries, []
+        return entries
+
+    def dump(self, path):
+        logging.info(f'DeadLetters: Saving {len(self)} failed requests '
+                     f'to {path}')
+        with open(path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+
+    def load(self, path):
+        with open(path, 'r') as f:
+            self.entries.extend(json.load(f))
@@ -0,0 +1,188 @@
+# STL imports
+import logging
+import math
+import multiprocessing
+import queue
+
+# Package imports
+import numpy as np
+
+import fbd.gatherer
+import fbd.tools
+from fbd.cache import ResponseCache
+from fbd.grid import HexGrid
+from fbd.progress import ProgressReporter
+
+
+def shard_points(points, n_shards):
+    '''
+    Splits an (n, 2) array of lat/lng points into n_shards spatially compact
+    shards: horizontal bands, each cut into roughly equal tiles
+    '''
+    n_bands = max(1, int(round(math.sqrt(n_shards))))
+    shards = []
+    bands = np.array_split(points[np.argsort(-points[:, 0])], n_bands)
+    for i, band in enumerate(bands):
+        # Spread the remaining shards over the remaining bands
+        n_tiles = (n_shards - len(shards)) // (n_bands - i)
+        shards.extend(np.array_split(band[np.argsort(band[:, 1])], n_tiles))
+    return [shard for shard in shards if len(shard)]
+
+
+class ShardStorage:
+    '''
+    Stands in for Storage inside the worker processes, the writes are
+    forwarded to the coordinator which owns the real Storage
+    '''
+
+    def __init__(self, messages, shard_id, place_ids):
+        self.messages = messages
+        self.shard_id = shard_id
+        self.place_ids = place_ids
+
+    def get_all_place_ids(self):
+        return self.place_ids
+
+    # The lists are copied, the queue pickles them in a background thread
+    # while the caller may already be reusing them
+    def save_placelist(self, placelist):
+        self.messages.put(('places', self.shard_id, list(placelist), False))
+
+    def update_placelist(self, placelist):
+        self.messages.put(('places', self.shard_id, list(placelist), True))
+
+    def save_crawl_cells(self, cells):
+        self.messages.put(('cells', self.shard_id, list(cells)))
+
+
+def _crawl_shard(shard_id, client_id, client_secret, gatherer_kwargs,
+                 cache_args, points, circle_radius, city, radius, refresh,
+                 place_ids, messages):
+    # Runs in a worker process with its own loop and session
+    logger = logging.getLogger(f'fbd.shard{shard_id}')
+    storage = ShardStorage(messages, shard_id, place_ids)
+    try:
+        cache = (ResponseCache(*cache_args, logger=logger)
+                 if cache_args else None)
+        gatherer = fbd.gatherer.Gatherer(client_id, client_secret,
+                                         storage=storage, logger=logger,
+                                         cache=cache,
+                                         progress=ProgressReporter('quiet'),
+                                         **gatherer_kwargs)
+        gatherer._prepare_crawl(circle_radius, city, radius, True, refresh,
+                                'grid')
+        try:
+            gatherer._run(gatherer._get_places_loc(
+                circle_radius, city, radius, True, None, refresh, 'grid',
+                points=[tuple(point) for point in points]))
+        finally:
+            messages.put(('dead_letters', shard_id,
+                          gatherer.dead_letters.pop_all()))
+            messages.put(('metrics', shard_id, gatherer.metrics.snapshot()))
+            gatherer.close()
+    except Exception as e:
+        logger.exception(f'Shard {shard_id}: {e}')
+        messages.put(('error', shard_id, repr(e)))
+    finally:
+        messages.put(('done', shard_id))
+
+
+def get_places_sharded(gatherer, circle_radius, city, radius, processes,
+                       save_storage=True, refresh=False, resume=False,
+                       stale_after=None):
+    '''
+    Crawls the grid of a city with one worker process (and event loop)
+    per shard. The coordinator merges the places into the gatherer's
+    storage, deduplicating the ones found by several shards.
+    '''
+    gatherer._prepare_crawl(circle_radius, city, radius, save_storage,
+                            refresh, 'grid', resume, stale_after)
+    grid = HexGrid(radius, circle_radius, *fbd.tools.get_coords(city))
+    todo = np.array([coords for coords in grid
+                     if not gatherer._fresh_cell_status(*coords,
+                                                        circle_radius)])
+    if not len(todo):
+        return [] if not save_storage else None
+    shards = shard_points(todo, processes)
+    gatherer.logger.info(f'Gatherer: Crawling {len(todo)} points '
+                         f'in {len(shards)} shards')
+
+    # The request rate is split between the workers
+    gatherer_kwargs = {
+        'connection_limit': gatherer.connection_limit,
+        'connection_limit_per_host': gatherer.connection_limit_per_host,
+        'keepalive_timeout': gatherer.keepalive_timeout,
+        'dns_cache_ttl': gatherer.dns_cache_ttl,
+        'rate_limit': gatherer.limiter.max_rate / len(shards),
+        'max_concurrency': gatherer.limiter.max_concurrency,
+        'max_retries': gatherer.max_retries,
+        'checkpoint_size': gatherer.checkpoint_size,
+        'pipeline_workers': gatherer.pipeline_workers,
+        'queue_size': gatherer.queue_size,
+        'save_batch_size': gatherer.save_batch_size,
+        'decoder': gatherer.decoder,
+        'place_fields': gatherer.place_fields,
+        'token_cache': gatherer.auth.path,
+        'derive_token': gatherer.auth.derive,
+        'graph_url': gatherer.GRAPH_URL,
+    }
+    cache = gatherer.cache
+    cache_args = (cache.path, cache.max_size, cache.ttls) if cache else None
+    context = multiprocessing.get_context('spawn')
+    messages = context.Queue(maxsize=gatherer.queue_size)
+    place_ids = list(gatherer.seen_place_ids)
+    workers = [
+        context.Process(
+            target=_crawl_shard,
+            args=(shard_id, gatherer.client_id, gatherer.client_secret,
+                  gatherer_kwargs, cache_args, shard, circle_radius, city,
+                  radius, refresh, place_ids, messages),
+            daemon=True)
+        for shard_id, shard in enumerate(shards)
+    ]
+    for worker in workers:
+        worker.start()
+
+    results = []
+    running = len(workers)
+    progress = gatherer.progress.task('Processing points', len(todo), 'point')
+    try:
+        while running:
+            try:
+                message = messages.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    gatherer.logger.error('Gatherer: Shard workers exited '
+                                          'without finishing')
+                    break
+                continue
+            kind, shard_id = message[:2]
+            if kind == 'places':
+                _, _, places, refresh_batch = message
+                places = [place for place in places
+                          if place['id'] not in gatherer.seen_place_ids]
+                gatherer.seen_place_ids.update(place['id']
+                                               for place in places)
+                if save_storage:
+                    gatherer._save_places(places, refresh_batch)
+                else:
+                    results.extend(places)
+            elif kind == 'cells':
+                progress.update(len(message[2]))
+                gatherer._checkpoint(message[2])
+            elif kind == 'dead_letters':
+                gatherer.dead_letters.entries.extend(message[2])
+            elif kind == 'metrics':
+                gatherer.metrics.merge(message[2])
+            elif kind == 'error':
+                gatherer.logger.error(f'Gatherer: Shard {shard_id} failed - '
+                                      f'{message[2]}')
+            elif kind == 'done':
+                running -= 1
+    finally:
+        progress.close()
+        gatherer._checkpoint([], flush=True)
+        for worker in workers:
+            worker.join(timeout=5)
+    if not save_storage:
+        return results
@@ -1,18 +1,30 @@
 #!/usr/local/bin/python3
 # STL imports
 import datetime
+import functools
 import json
 import logging
 import pprint
+import time
 
 # Package imports
 import dateutil.parser
 import sqlalchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import (relationship, scoped_session, sessionmaker,
                             validates)
 
 import fbd.tools
+from fbd.batching import chunks
+from fbd.fields import REACTION_TYPES
+from fbd.metrics import REGISTRY
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
 
 
 def default_json_serializer(obj):
@@ -21,12 +33,32 @@ def default_json_serializer(obj):
     '''
     if isinstance(obj, datetime.datetime):
         return obj.isoformat()
-    if (isinstance(obj, Topic) or isinstance(obj, Place) or
-            isinstance(obj, Event)):
+    if isinstance(obj, (Topic, Place, Event, CrawlCell, Page, Post)):
         return obj.to_dict()
     raise TypeError('{} type could not be serialized.'.format(type(obj)))
 
 
+def instrumented(count=len):
+    # Records the duration and the number of rows of a storage write,
+    # count gets the first argument (a list of rows by default)
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, rows, *args, **kwargs):
+            with self.metrics.timer('fbd_db_seconds', op=method.__name__):
+                result = method(self, rows, *args, **kwargs)
+            self.metrics.inc('fbd_db_rows_total', count(rows),
+                             op=method.__name__)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def single_row(row):
+    return 1
+
+
 Base = declarative_base()
 
 place_topic = sqlalchemy.Table(
@@ -75,24 +107,38 @@ class Topic(Base):
 class Place(Base):
     __tablename__ = 'Place'
 
+    # Graph field each column comes from, a column is only overwritten
+    # when its field was downloaded (see fbd.fields)
+    SOURCE_FIELDS = {
+        'name': 'name',
+        'ptype': 'place_type',
+        'city': 'location',
+        'country': 'location',
+        'lat': 'location',
+        'lon': 'location',
+        'street': 'location',
+        'zip': 'location',
+    }
+
     @classmethod
     def from_dict(cls, place_dict):
         place_loc = place_dict.get('location', {})
         topic_list = []
-        if place_dict.get('place_dict_topics'):
+        if place_dict.get('place_topics'):
             topic_list = [Topic.from_dict(topic_dict)
                           for topic_dict
-                          in place_dict['place_dict_topics'].get('data')]
+                          in place_dict['place_topics'].get('data', [])]
         return cls(id=place_dict['id'],
                    topics=topic_list,
-                   ptype=place_dict.get('place_dict_type', 'UNKNOWN'),
+                   ptype=place_dict.get('place_type', 'UNKNOWN'),
                    name=place_dict.get('name', 'Unnamed'),
                    city=place_loc.get('city', 'Wroclaw'),
                    country=place_loc.get('country', 'Poland'),
                    lat=place_loc.get('latitude', 0.0),
                    lon=place_loc.get('longitude', 0.0),
                    street=place_loc.get('street', 'Unknown'),
-                   zip=place_loc.get('zip', '00-000'))
+                   zip=place_loc.get('zip', '00-000'),
+                   fetched_time=datetime.datetime.utcnow())
 
     def to_json(self):
         return json.dumps(
@@ -115,6 +161,7 @@ class Place(Base):
             'lon': self.lon,
             'street': self.street,
             'zip': self.zip,
+            'fetched_time': self.fetched_time,
         }
 
     id = sqlalchemy.Column(sqlalchemy.String(200), primary_key=True)
@@ -127,6 +174,8 @@ class Place(Base):
     street = sqlalchemy.Column(sqlalchemy.String(100))
     topics = relationship('Topic', secondary=place_topic, cascade='save-update')
     zip = sqlalchemy.Column(sqlalchemy.String(6))
+    # When the details were last downloaded, drives the incremental updates
+    fetched_time = sqlalchemy.Column(sqlalchemy.DateTime, index=True)
 
     @validates('name', 'ptype', 'street', 'country', 'zip')
     def validate_trunc(self, key, value):
@@ -136,7 +185,7 @@ class Place(Base):
         return value
 
     def __init__(self, id, name, topics, ptype, city, country, lat, lon, street,
-                 zip):
+                 zip, fetched_time=None):
         self.id = id
         self.name = name
         self.ptype = ptype
@@ -147,6 +196,7 @@ class Place(Base):
         self.lon = lon
         self.street = street
         self.zip = zip
+        self.fetched_time = fetched_time
 
     def __repr__(self):
         return '<Place {} - {}>'.format(self.id, self.name)
@@ -158,6 +208,16 @@ class Place(Base):
 class Event(Base):
     __tablename__ = 'Event'
 
+    # Graph field each column comes from (see Place.SOURCE_FIELDS)
+    SOURCE_FIELDS = {
+        'name': 'name',
+        'description': 'description',
+        'picture_url': 'picture',
+        'ticket_url': 'ticket_uri',
+        'start_time': 'start_time',
+        'place_id': 'place_id',
+    }
+
     @classmethod
     def from_dict(cls, event_dict):
         return cls(
@@ -167,7 +227,7 @@ class Event(Base):
             picture_url=event_dict.get('picture', {})
             .get('data', {}).get('url', 'None'),
             ticket_url=event_dict.get('ticket_uri', 'None'),
-            place_id=event_dict.get['place_id'],
+            place_id=event_dict.get('place_id'),
             start_time=dateutil.parser.parse(
                 event_dict.get(
                     'start_time',
@@ -236,133 +296,254 @@ class Event(Base):
         return pprint.pformat(self.to_dict())
 
 
-# TODO: Implement 'Page' class
-# class Page(Base):
-#     __tablename__ = 'Page'
-#     id = sqlalchemy.Column(sqlalchemy.String(50), primary_key=True)
-#     message = sqlalchemy.Column(sqlalchemy.String(10000))
-#     link = sqlalchemy.Column(sqlalchemy.String(150))
-#     created_time = sqlalchemy.Column(sqlalchemy.DateTime)
-#
-#     like = sqlalchemy.Column(sqlalchemy.Integer())
-#     love = sqlalchemy.Column(sqlalchemy.Integer())
-#     haha = sqlalchemy.Column(sqlalchemy.Integer())
-#     wow = sqlalchemy.Column(sqlalchemy.Integer())
-#     sad = sqlalchemy.Column(sqlalchemy.Integer())
-#     angry = sqlalchemy.Column(sqlalchemy.Integer())
-#     thankful = sqlalchemy.Column(sqlalchemy.Integer())
-#
-#     page_id = sqlalchemy.Column(sqlalchemy.String(50), sqlalchemy.ForeignKey('Page.id'))
-#     page = relationship('Page', backref='posts', foreign_keys=[page_id])
-#
-#     @validates('message')
-#     def validate_trunc(self, key, value):
-#         max_len = getattr(self.__class__, key).prop.columns[0].type.length
-#         if value and len(value) > max_len:
-#             return value[:max_len]
-#         return value
-#
-#     @validates('link')
-#     def validate_strict(self, key, value):
-#         max_len = getattr(self.__class__, key).prop.columns[0].type.length
-#         if value and len(value) > max_len:
-#             return 'None'
-#         return value
-#
-#     def __init__(self, id, page_id, message, link, created_time, like, love, haha, wow, sad, angry, thankful):
-#         self.id = id
-#         self.message = message
-#         self.page_id = page_id
-#         self.message = message
-#         self.link = link
-#         self.created_time = created_time
-#         self.like = like
-#         self.love = love
-#         self.haha = haha
-#         self.wow = wow
-#         self.sad = sad
-#         self.angry = angry
-#         self.thankful = thankful
-#
-#     def __repr__(self):
-#         return '<Post {} - {}>'.format(self.id, self.message[:25])
-#
-#     def __str__(self):
-#         return '<Post {} - {}>'.format(self.id, self.message[:25])
-
-# TODO: Implement 'Post' class
-# class Post(Base):
-#     __tablename__ = 'Post'
-#     id = sqlalchemy.Column(sqlalchemy.String(50), primary_key=True)
-#     message = sqlalchemy.Column(sqlalchemy.String(10000))
-#     link = sqlalchemy.Column(sqlalchemy.String(150))
-#     created_time = sqlalchemy.Column(sqlalchemy.DateTime)
-#
-#     like = sqlalchemy.Column(sqlalchemy.Integer())
-#     love = sqlalchemy.Column(sqlalchemy.Integer())
-#     haha = sqlalchemy.Column(sqlalchemy.Integer())
-#     wow = sqlalchemy.Column(sqlalchemy.Integer())
-#     sad = sqlalchemy.Column(sqlalchemy.Integer())
-#     angry = sqlalchemy.Column(sqlalchemy.Integer())
-#     thankful = sqlalchemy.Column(sqlalchemy.Integer())
-#
-#     page_id = sqlalchemy.Column(sqlalchemy.String(
-#         50), sqlalchemy.ForeignKey('Page.id'))
-#     page = relationship('Page', backref='posts', foreign_keys=[page_id])
-#
-#     @validates('message')
-#     def validate_trunc(self, key, value):
-#         max_len = getattr(self.__class__, key).prop.columns[0].type.length
-#         if value and len(value) > max_len:
-#             return value[:max_len]
-#         return value
-#
-#     @validates('link')
-#     def validate_strict(self, key, value):
-#         max_len = getattr(self.__class__, key).prop.columns[0].type.length
-#         if value and len(value) > max_len:
-#             return 'None'
-#         return value
-#
-#     def __init__(self, id, page_id, message, link, created_time, like, love, haha, wow, sad, angry, thankful):
-#         self.id = id
-#         self.message = message
-#         self.page_id = page_id
-#         self.link = link
-#         self.created_time = created_time
-#         self.like = like
-#         self.love = love
-#         self.haha = haha
-#         self.wow = wow
-#         self.sad = sad
-#         self.angry = angry
-#         self.thankful = thankful
-#
-#     def __repr__(self):
-#         return '<Post {} - {}>'.format(self.id, self.message[:25])
-#
-#     def __str__(self):
-#         return '<Post {} - {}>'.format(self.id, self.message[:25])
-#
-#
+class CrawlCell(Base):
+    __tablename__ = 'CrawlCell'
+
+    def to_dict(self):
+        return {
+            'crawl': self.crawl,
+            'point': self.point,
+            'lat': self.lat,
+            'lon': self.lon,
+            'circle_radius': self.circle_radius,
+            'status': self.status,
+            'result_count': self.result_count,
+            'updated_time': self.updated_time,
+        }
+
+    # Identifies the crawl (city, radius, ...) and the point/cell within it
+    crawl = sqlalchemy.Column(sqlalchemy.String(200), primary_key=True)
+    point = sqlalchemy.Column(sqlalchemy.String(100), primary_key=True)
+    lat = sqlalchemy.Column(sqlalchemy.Float())
+    lon = sqlalchemy.Column(sqlalchemy.Float())
+    circle_radius = sqlalchemy.Column(sqlalchemy.Float())
+    status = sqlalchemy.Column(sqlalchemy.String(10))
+    result_count = sqlalchemy.Column(sqlalchemy.Integer())
+    updated_time = sqlalchemy.Column(sqlalchemy.DateTime)
+
+    def __repr__(self):
+        return '<CrawlCell {} {} - {}>'.format(self.crawl, self.point,
+                                               self.status)
+
+
+class Page(Base):
+    __tablename__ = 'Page'
+
+    # Graph field each column comes from (see Place.SOURCE_FIELDS)
+    SOURCE_FIELDS = {
+        'name': 'name',
+        'about': 'about',
+        'category': 'category',
+        'fan_count': 'fan_count',
+    }
+
+    @classmethod
+    def from_dict(cls, page_dict):
+        return cls(
+            id=page_dict['id'],
+            name=page_dict.get('name', 'Unnamed'),
+            about=page_dict.get('about'),
+            category=page_dict.get('category'),
+            fan_count=page_dict.get('fan_count'),
+        )
+
+    def to_json(self):
+        return json.dumps(
+            self.to_dict(),
+            default=default_json_serializer,
+            separators=(',', ':'),
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'about': self.about,
+            'category': self.category,
+            'fan_count': self.fan_count,
+        }
+
+    id = sqlalchemy.Column(sqlalchemy.String(50), primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.String(100))
+    about = sqlalchemy.Column(sqlalchemy.String(1000))
+    category = sqlalchemy.Column(sqlalchemy.String(100))
+    fan_count = sqlalchemy.Column(sqlalchemy.Integer())
+
+    @validates('name', 'about', 'category')
+    def validate_trunc(self, key, value):
+        max_len = getattr(self.__class__, key).prop.columns[0].type.length
+        if value and len(value) > max_len:
+            return value[:max_len]
+        return value
+
+    def __init__(self, id, name, about, category, fan_count):
+        self.id = id
+        self.name = name
+        self.about = about
+        self.category = category
+        self.fan_count = fan_count
+
+    def __repr__(self):
+        return '<Page {} - {}>'.format(self.id, self.name)
+
+    def __str__(self):
+        return '<Page {} - {}>'.format(self.id, self.name)
+
+
+class Post(Base):
+    __tablename__ = 'Post'
+
+    # Graph field each column comes from (see Place.SOURCE_FIELDS), the
+    # reaction counts come from their aliased summaries
+    SOURCE_FIELDS = dict({
+        'page_id': 'page_id',
+        'message': 'message',
+        'link': 'link',
+        'created_time': 'created_time',
+    }, **{reaction: reaction for reaction in REACTION_TYPES})
+
+    @classmethod
+    def from_dict(cls, post_dict):
+        return cls(
+            id=post_dict['id'],
+            page_id=post_dict.get('page_id'),
+            message=post_dict.get('message'),
+            link=post_dict.get('link'),
+            created_time=dateutil.parser.parse(post_dict['created_time'])
+            if post_dict.get('created_time') else None,
+            like=post_dict.get('like'),
+            love=post_dict.get('love'),
+            haha=post_dict.get('haha'),
+            wow=post_dict.get('wow'),
+            sad=post_dict.get('sad'),
+            angry=post_dict.get('angry'),
+            thankful=post_dict.get('thankful'),
+        )
+
+    def to_json(self):
+        return json.dumps(
+            self.to_dict(),
+            default=default_json_serializer,
+            separators=(',', ':'),
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'page_id': self.page_id,
+            'message': self.message,
+            'link': self.link,
+            'created_time': self.created_time,
+            'like': self.like,
+            'love': self.love,
+            'haha': self.haha,
+            'wow': self.wow,
+            'sad': self.sad,
+            'angry': self.angry,
+            'thankful': self.thankful,
+        }
+
+    id = sqlalchemy.Column(sqlalchemy.String(50), primary_key=True)
+    message = sqlalchemy.Column(sqlalchemy.String(10000))
+    link = sqlalchemy.Column(sqlalchemy.String(150))
+    created_time = sqlalchemy.Column(sqlalchemy.DateTime)
+
+    like = sqlalchemy.Column(sqlalchemy.Integer())
+    love = sqlalchemy.Column(sqlalchemy.Integer())
+    haha = sqlalchemy.Column(sqlalchemy.Integer())
+    wow = sqlalchemy.Column(sqlalchemy.Integer())
+    sad = sqlalchemy.Column(sqlalchemy.Integer())
+    angry = sqlalchemy.Column(sqlalchemy.Integer())
+    thankful = sqlalchemy.Column(sqlalchemy.Integer())
+
+    page_id = sqlalchemy.Column(
+        sqlalchemy.String(50), sqlalchemy.ForeignKey('Page.id'), index=True)
+    page = relationship('Page', backref='posts', foreign_keys=[page_id])
+
+    @validates('message')
+    def validate_trunc(self, key, value):
+        max_len = getattr(self.__class__, key).prop.columns[0].type.length
+        if value and len(value) > max_len:
+            return value[:max_len]
+        return value
+
+    @validates('link')
+    def validate_strict(self, key, value):
+        max_len = getattr(self.__class__, key).prop.columns[0].type.length
+        if value and len(value) > max_len:
+            return 'None'
+        return value
+
+    def __init__(self, id, page_id, message, link, created_time, like, love,
+                 haha, wow, sad, angry, thankful):
+        self.id = id
+        self.page_id = page_id
+        self.message = message
+        self.link = link
+        self.created_time = created_time
+        self.like = like
+        self.love = love
+        self.haha = haha
+        self.wow = wow
+        self.sad = sad
+        self.angry = angry
+        self.thankful = thankful
+
+    def __repr__(self):
+        return '<Post {} - {}>'.format(self.id, (self.message or '')[:25])
+
+    def __str__(self):
+        return '<Post {} - {}>'.format(self.id, (self.message or '')[:25])
 
 
 class Storage:
 
-    def __init__(self, db_url='sqlite:///db/fb.sqlite'):
-        self.db = sqlalchemy.create_engine(db_url)
+    def __init__(self, db_url='sqlite:///db/fb.sqlite', metrics=None):
+        self.metrics = metrics if metrics else REGISTRY
+        if db_url in ('sqlite://', 'sqlite:///:memory:'):
+            # Every thread would get its own empty in-memory database
+            self.db = sqlalchemy.create_engine(
+                db_url, poolclass=sqlalchemy.pool.StaticPool,
+                connect_args={'check_same_thread': False})
+        else:
+            self.db = sqlalchemy.create_engine(db_url)
         try:
             Base.metadata.create_all(self.db)
         except Exception as e:
             logging.debug(e)
             pass
-        session = scoped_session(sessionmaker(bind=self.db))
-        self.session_factory = session
-        self.session = self.session_factory()
+        session_maker = sessionmaker(bind=self.db)
+        # One session per thread, e.g. for the gatherer's writer thread
+        self.session_factory = scoped_session(session_maker)
+        # Times the flush and commit of every transaction
+        sqlalchemy.event.listen(session_maker, 'before_commit',
+                                self._before_commit)
+        sqlalchemy.event.listen(session_maker, 'after_commit',
+                                self._after_commit)
+
+    @property
+    def session(self):
+        return self.session_factory()
+
+    def close_session(self):
+        '''
+        Closes the session of the calling thread
+        '''
+        self.session_factory.remove()
+
+    def _before_commit(self, session):
+        session.info['commit_start'] = time.perf_counter()
+
+    def _after_commit(self, session):
+        start = session.info.pop('commit_start', None)
+        if start is not None:
+            self.metrics.observe('fbd_db_commit_seconds',
+                                 time.perf_counter() - start)
 
     def __del__(self):
         self.session_factory.remove()
 
+    @instrumented()
     def save_eventlist(self, eventlist, commit=True):
         try:
             eventlist = [Event.from_dict(event_dict)
@@ -378,19 +559,177 @@ class Storage:
             logging.exception(f'Storage.save_eventlist: {e}')
 
     def save_placelist(self, placelist, commit=True):
+        self.upsert_placelist(placelist, commit)
+
+    @staticmethod
+    def _row(obj):
+        return {column.key: getattr(obj, column.key)
+                for column in obj.__table__.columns}
+
+    def _merge_rows(self, table, rows, update_columns=None):
+        # One executemany of INSERT ... ON CONFLICT (id) DO UPDATE for all
+        # the rows. Other dialects look the ids up and use two bulk
+        # statements instead. The known rows only get update_columns
+        # overwritten (all of them by default)
+        if not rows:
+            return
+        if update_columns is None:
+            update_columns = [column.key for column in table.columns
+                              if not column.primary_key]
+        insert = UPSERT_INSERTS.get(self.db.dialect.name)
+        if insert:
+            stmt = insert(table)
+            if update_columns:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.id],
+                    set_={key: stmt.excluded[key] for key in update_columns},
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.id])
+            self.session.execute(stmt, rows)
+            return
+        existing = set()
+        for batch in chunks([row['id'] for row in rows], 500):
+            existing.update(id for (id,) in self.session.execute(
+                sqlalchemy.select(table.c.id).where(table.c.id.in_(batch))))
+        updates = [dict({key: row[key] for key in update_columns},
+                        _id=row['id'])
+                   for row in rows if row['id'] in existing]
+        if updates and update_columns:
+            self.session.execute(
+                table.update().where(
+                    table.c.id == sqlalchemy.bindparam('_id')),
+                updates)
+        inserts = [row for row in rows if row['id'] not in existing]
+        if inserts:
+            self.session.execute(table.insert(), inserts)
+
+    @staticmethod
+    def _source_columns(cls, obj_dict):
+        # The columns whose Graph field is in obj_dict, the others only hold
+        # the from_dict defaults
+        return tuple(column for column, field in cls.SOURCE_FIELDS.items()
+                     if field in obj_dict)
+
+    def _merge_groups(self, table, rows):
+        # rows maps ids to (columns to overwrite, row), grouped by the
+        # columns, usually a single group
+        groups = {}
+        for columns, row in rows.values():
+            groups.setdefault(columns, []).append(row)
+        for columns, group in groups.items():
+            self._merge_rows(table, group, columns)
+
+    def _upsert(self, cls, dicts, commit=True):
+        # Inserts the new objects and overwrites the known ones, instead of
+        # relying on IntegrityError for duplicates. The rows go through
+        # from_dict for the validators, the last duplicate wins. Known rows
+        # only get the columns present in their dicts overwritten
+        rows = {}
+        for obj_dict in dicts:
+            obj = cls.from_dict(obj_dict)
+            rows[obj.id] = (self._source_columns(cls, obj_dict),
+                            self._row(obj))
+        self._merge_groups(cls.__table__, rows)
+        if commit:
+            self.session.commit()
+
+    @instrumented()
+    def upsert_placelist(self, placelist, commit=True):
+        '''
+        Inserts or overwrites the places with their topics and Place_Topic
+        links, in one transaction and a few statements for the whole list.
+        Stored places only get the columns present in their dicts
+        overwritten (see Place.SOURCE_FIELDS), their links are replaced
+        when the dict has place_topics.
+        '''
         try:
-            placelist = [Place.from_dict(pdict)
-                         for pdict in placelist]
-            self.session.bulk_save_objects(placelist)
+            places, topics, links = {}, {}, {}
+            for pdict in placelist:
+                place = Place.from_dict(pdict)
+                columns = (self._source_columns(Place, pdict)
+                           + ('fetched_time',))
+                places[place.id] = columns, self._row(place)
+                if 'place_topics' in pdict:
+                    links[place.id] = {topic.id for topic in place.topics}
+                    for topic in place.topics:
+                        topics[topic.id] = self._row(topic)
+            self._merge_rows(Topic.__table__, list(topics.values()))
+            self._merge_groups(Place.__table__, places)
+            for batch in chunks(list(links), 500):
+                self.session.execute(place_topic.delete().where(
+                    place_topic.c.place_id.in_(batch)))
+            link_rows = [
+                {'place_id': place_id, 'topic_id': topic_id}
+                for place_id, topic_ids in links.items()
+                for topic_id in topic_ids
+            ]
+            if link_rows:
+                self.session.execute(place_topic.insert(), link_rows)
             if commit:
                 self.session.commit()
-        except sqlalchemy.exc.IntegrityError as e:
-            logging.debug(f'Storage.save_placelist: {e}')
+        except Exception as e:
             self.session.rollback()
+            logging.exception(f'Storage.upsert_placelist: {e}')
+
+    @instrumented()
+    def upsert_eventlist(self, eventlist, commit=True):
+        try:
+            self._upsert(Event, eventlist, commit)
         except Exception as e:
             self.session.rollback()
-            logging.exception(f'Storage.save_placelist: {e}')
+            logging.exception(f'Storage.upsert_eventlist: {e}')
 
+    @instrumented()
+    def upsert_pagelist(self, pagelist, commit=True):
+        try:
+            self._upsert(Page, pagelist, commit)
+        except Exception as e:
+            self.session.rollback()
+            logging.exception(f'Storage.upsert_pagelist: {e}')
+
+    @instrumented()
+    def upsert_postlist(self, postlist, commit=True):
+        try:
+            self._upsert(Post, postlist, commit)
+        except Exception as e:
+            self.session.rollback()
+            logging.exception(f'Storage.upsert_postlist: {e}')
+
+    @instrumented()
+    def touch_places(self, place_ids, commit=True):
+        '''
+        Marks the places as fetched now without changing their details, so
+        that ids which failed to update (e.g. deleted places) don't stay
+        first in line for get_stale_place_ids
+        '''
+        try:
+            now = datetime.datetime.utcnow()
+            for batch in chunks(list(place_ids), 500):
+                self.session.execute(
+                    Place.__table__.update()
+                    .where(Place.id.in_(batch))
+                    .values(fetched_time=now))
+            if commit:
+                self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            logging.exception(f'Storage.touch_places: {e}')
+
+    @instrumented()
+    def update_reactions(self, reactions, commit=True):
+        # reactions maps post ids to dicts of counts, one bulk UPDATE
+        try:
+            self.session.bulk_update_mappings(
+                Post, [dict(counts, id=post_id)
+                       for post_id, counts in reactions.items()])
+            if commit:
+                self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            logging.exception(f'Storage.update_reactions: {e}')
+
+    @instrumented()
     def save_topiclist(self, topiclist, commit=True):
         try:
             topiclist = [Topic.from_dict(topic_dict)
@@ -405,6 +744,7 @@ class Storage:
             self.session.rollback()
             logging.exception(f'Storage.save_topiclist: {e}')
 
+    @instrumented(single_row)
     def save_event(self, event_dict, commit=True):
         try:
             event = Event.from_dict(event_dict)
@@ -418,6 +758,7 @@ class Storage:
             self.session.rollback()
             logging.exception(f'Storage.save_event: {e}')
 
+    @instrumented(single_row)
     def save_topic(self, topic_dict, commit=True):
         try:
             if self.topic_exists(topic_dict.get('id')):
@@ -434,6 +775,7 @@ class Storage:
             self.session.rollback()
             logging.exception(f'Storage.save_topic: {e}')
 
+    @instrumented(single_row)
     def save_place(self, place_dict, commit=True):
         try:
             place = Place.from_dict(place_dict)
@@ -448,51 +790,91 @@ class Storage:
             logging.exception(f'Storage.save_place: {e}')
 
     def update_place(self, place, commit=True):
-        # TODO: update and use session.merge
         logging.debug(f'Storage: update_place request, place = {place}')
+        self.update_placelist([place], commit)
+        return self.get_place(place['id'])
+
+    def update_placelist(self, placelist, commit=True):
+        self.upsert_placelist(placelist, commit)
+
+    @instrumented()
+    def save_crawl_cells(self, cells, commit=True):
+        # Upserts the crawl state of many cells with two bulk statements
         try:
-            # IDEA: Move this to the place class and pass in a string list
-            if self.place_exists(place['id']):
-                place_loc = place.get('location', {})
-                topic_list = []
-                if place.get('place_topics', None):
-                    for topic in place['place_topics'].get('data'):
-                        topic_list.append(
-                            Topic.from_dict({
-                                'name': topic['name'],
-                                'id': topic['id']
-                            }))
-                old_place = self.get_place(place['id'])
-                old_place.topics = topic_list
-                old_place.ptype = place.get('place_type', 'UNKNOWN')
-                old_place.name = place['name']
-                old_place.city = place_loc.get('city')
-                old_place.country = place_loc.get('country')
-                old_place.lat = place_loc['latitude']
-                old_place.lon = place_loc['longitude']
-                old_place.street = place_loc.get('street')
-                old_place.zip = place_loc.get('zip')
-                if commit:
-                    self.session.commit()
-                return old_place
-            else:
-                return self.save_place(place, commit)
-        except sqlalchemy.exc.IntegrityError as e:
-            logging.debug(f'Storage.update_place: {e}')
-            self.session.rollback()
+            by_crawl = {}
+            for cell in cells:
+                by_crawl.setdefault(cell['crawl'], []).append(cell)
+            for crawl, crawl_cells in by_crawl.items():
+                existing = {
+                    point for (point,) in self.session.query(CrawlCell.point)
+                    .filter(CrawlCell.crawl == crawl)
+                    .filter(CrawlCell.point.in_(
+                        [cell['point'] for cell in crawl_cells]))
+                }
+                self.session.bulk_update_mappings(
+                    CrawlCell,
+                    [cell for cell in crawl_cells if cell['point'] in existing])
+                self.session.bulk_insert_mappings(
+                    CrawlCell,
+                    [cell for cell in crawl_cells
+                     if cell['point'] not in existing])
+            if commit:
+                self.session.commit()
         except Exception as e:
             self.session.rollback()
-            logging.exception(f'Storage.update_place: {e}')
+            logging.exception(f'Storage.save_crawl_cells: {e}')
 
-    def save_post(self):
-        pass
+    def get_crawl_cells(self, crawl):
+        return {
+            cell.point: cell.to_dict()
+            for cell in self.session.query(CrawlCell).filter_by(crawl=crawl)
+        }
 
-    def save_page(self):
-        pass
+    def save_post(self, post_dict, commit=True):
+        self.upsert_postlist([post_dict], commit)
+
+    def save_page(self, page_dict, commit=True):
+        self.upsert_pagelist([page_dict], commit)
 
     def get_all_place_ids(self):
         return [id[0] for id in self.session.query(Place.id).all()]
 
+    def get_stale_place_ids(self, max_age=None, limit=None):
+        '''
+        Ids of the places which were never fetched or were fetched more than
+        max_age (a timedelta) ago, the oldest ones first
+        '''
+        query = self.session.query(Place.id)
+        if max_age is not None:
+            cutoff = datetime.datetime.utcnow() - max_age
+            query = query.filter(
+                sqlalchemy.or_(Place.fetched_time.is_(None),
+                               Place.fetched_time < cutoff))
+        # Portable NULLS FIRST
+        query = query.order_by(Place.fetched_time.isnot(None),
+                               Place.fetched_time)
+        if limit is not None:
+            query = query.limit(limit)
+        return [id[0] for id in query.all()]
+
+    def get_event_watermarks(self):
+        '''
+        Start time of the newest known event of every place with events
+        '''
+        return dict(
+            self.session.query(Event.place_id,
+                               sqlalchemy.func.max(Event.start_time))
+            .group_by(Event.place_id).all())
+
+    def get_all_page_ids(self):
+        return [id[0] for id in self.session.query(Page.id).all()]
+
+    def get_all_post_ids(self, page_id=None):
+        query = self.session.query(Post.id)
+        if page_id is not None:
+            query = query.filter_by(page_id=page_id)
+        return [id[0] for id in query.all()]
+
     def get_all_event_ids(self):
         return [id[0] for id in self.session.query(Event.id).all()]
 
@@ -1,17 +1,143 @@
-from geopy.geocoders import Nominatim
+import json
+import logging
+import math
+import os
+import time
 
+# Tuned for Wroclaw, used when the latitude isn't known
 LAT_PER_100M = 0.001622 / 1.8
 LONG_PER_100M = 0.005083 / 5.5
 
 
-def lat_from_met(met):
-    return LAT_PER_100M * float(met) / 100.0
+def met_per_deg_lat(lat):
+    phi = math.radians(lat)
+    return 111132.92 - 559.82 * math.cos(2 * phi) + 1.175 * math.cos(4 * phi)
 
 
-def lon_from_met(met):
-    return LONG_PER_100M * float(met) / 100
+def met_per_deg_lon(lat):
+    phi = math.radians(lat)
+    return 111412.84 * math.cos(phi) - 93.5 * math.cos(3 * phi)
+
+
+def lat_from_met(met, lat=None):
+    if lat is None:
+        return LAT_PER_100M * float(met) / 100.0
+    return float(met) / met_per_deg_lat(lat)
+
+
+def lon_from_met(met, lat=None):
+    if lat is None:
+        return LONG_PER_100M * float(met) / 100
+    return float(met) / met_per_deg_lon(lat)
+
+
+# Where the geocoding results are kept and for how long (seconds)
+GEOCODE_CACHE = '.fbd_geocode.json'
+GEOCODE_TTL = 90 * 24 * 60 * 60
+
+# Cities pinned to fixed coordinates, never looked up
+PINNED_CITIES = {}
+
+
+def _city_key(city):
+    return ' '.join(city.lower().split())
+
+
+def pin_city(city, lat, lon, bbox=None):
+    '''
+    Pins a city to lat/lon and optionally to a (south, north, west, east)
+    bounding box
+    '''
+    PINNED_CITIES[_city_key(city)] = {
+        'lat': float(lat),
+        'lon': float(lon),
+        'bbox': [float(edge) for edge in bbox] if bbox else None,
+    }
+
+
+def pin_cities(cities):
+    # cities maps the names to dicts with lat, lon and optionally bbox,
+    # like the 'cities' entry of config.json
+    for city, entry in cities.items():
+        pin_city(city, entry['lat'], entry['lon'], entry.get('bbox'))
+
+
+def _load_geocode_cache(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_geocode_cache(path, cache):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def geocode(city, cache_path=None, ttl=None):
+    '''
+    Location entry (lat, lon, bbox) of a city: the pinned one, the cached
+    one if it's younger than ttl or a fresh Nominatim lookup. A stale entry
+    is still used if the lookup fails, e.g. when offline.
+    '''
+    key = _city_key(city)
+    if key in PINNED_CITIES:
+        return PINNED_CITIES[key]
+    cache_path = cache_path if cache_path is not None else GEOCODE_CACHE
+    ttl = ttl if ttl is not None else GEOCODE_TTL
+    cache = _load_geocode_cache(cache_path) if cache_path else {}
+    entry = cache.get(key)
+    if entry and time.time() - entry['time'] <= ttl:
+        return entry
+    try:
+        # geopy is slow to import and only needed on a cache miss
+        from geopy.geocoders import Nominatim
+        loc = Nominatim().geocode(city)
+    except Exception as e:
+        if not entry:
+            raise
+        logging.warning(f'tools.geocode: Using a stale entry for {city} - '
+                        f'{e!r}')
+        return entry
+    if loc is None:
+        raise ValueError(f'Couldn\'t geocode {city}')
+    bbox = loc.raw.get('boundingbox')
+    entry = {
+        'lat': loc.latitude,
+        'lon': loc.longitude,
+        'bbox': [float(edge) for edge in bbox] if bbox else None,
+        'time': time.time(),
+    }
+    if cache_path:
+        cache[key] = entry
+        _save_geocode_cache(cache_path, cache)
+    return entry
 
 
 def get_coords(city):
-    loc = Nominatim().geocode(city)
-    return loc.latitude, loc.longitude
+    entry = geocode(city)
+    return entry['lat'], entry['lon']
+
+
+def get_bbox(city):
+    # (south, north, west, east) or None
+    return geocode(city)['bbox']
+
+
+def get_radius(city):
+    '''
+    Radius (meters) of the circle around the city's coordinates which
+    covers its bounding box
+    '''
+    entry = geocode(city)
+    if not entry['bbox']:
+        raise ValueError(f'No bounding box known for {city}')
+    south, north, west, east = entry['bbox']
+    lat, lon = entry['lat'], entry['lon']
+    return max(
+        math.hypot((edge_lat - lat) * met_per_deg_lat(lat),
+                   (edge_lon - lon) * met_per_deg_lon(lat))
+        for edge_lat in (south, north) for edge_lon in (west, east))
@@ -5,16 +5,12 @@ import logging
 import os
 
 # Package imports
-import gmplot
-import matplotlib.pyplot as plt
-import numpy as np
-from bokeh.io import output_file, show
-from bokeh.models import (BoxSelectTool, Circle, ColumnDataSource, DataRange1d,
-                          GMapOptions, GMapPlot, PanTool, WheelZoomTool)
-from bokeh.plotting import figure
+# The plotting libraries take seconds to import, so every plot imports
+# only the ones it uses
 from sqlalchemy import desc, func
 
 # Project imports
+from fbd import tools
 from fbd.storage import Event, Place, Storage
 
 
@@ -31,6 +27,8 @@ class Visualizer:
         return fpath
 
     def plot_event_count(self, top=5):
+        import matplotlib.pyplot as plt
+        import numpy as np
 
         logging.debug('Visualizer - plot_event_count: Getting the data')
         to_plot = self.storage.session.query(Place.name,
@@ -59,8 +57,10 @@ class Visualizer:
         plt.show()
 
     def plot_gmaps(self, filename='vis_out/gmap.html'):
+        import gmplot
+
         logging.debug('Visualizer - gmaps_plot: Requesting location')
-        gmap = gmplot.GoogleMapPlotter.from_geocode('Wrocław')
+        gmap = gmplot.GoogleMapPlotter(*tools.get_coords('Wrocław'), 13)
         lats = []
         lngs = []
 
@@ -78,6 +78,9 @@ class Visualizer:
         gmap.draw(self._get_fpath(filename, delete_old=True))
 
     def plot_gmaps_bokeh(self, api_key, filename='vis_out/bokeh.html'):
+        from bokeh.io import show
+        from bokeh.models import ColumnDataSource, Scatter
+        from bokeh.plotting import figure
 
         lats = []
         lngs = []
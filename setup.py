@@ -35,7 +35,7 @@ setup(
     install_requires=[
         'tqdm',
         'bokeh',
-        'SQLAlchemy',
+        'SQLAlchemy>=1.4',
         'setuptools',
         'aiohttp',
         'geopy',
@@ -47,6 +47,9 @@ setup(
         'async_timeout',
         'python_dateutil',
     ],
+    extras_require={
+        'fast': ['orjson'],
+    },
     include_package_data=True,
     zip_safe=False,
 )